@@ -1,21 +1,36 @@
 """Batch processing orchestration for SPY History Features Lambda."""
 
+import gzip
+import io
+import itertools
+import json
 import logging
-import boto3
-from botocore.config import Config
-import yaml
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Set, Optional
+import os
+from botocore.exceptions import ClientError
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Set, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
 
 from lambda_client import LambdaClient
+from rate_limiter import TokenBucket
 from date_thread import DateThread
 
 logger = logging.getLogger(__name__)
 
 
+# Hard ceiling on worker threads regardless of CLI/env/config
+MAX_THREADS_CAP = 512
+
+# ReservedConcurrentExecutions of the function in template.yaml; batches in
+# flight beyond this are throttled rather than run
+DEFAULT_RESERVED_CONCURRENCY = 40
+
+# Root prefix of minute files in both buckets ("one-minute/YYYYMMDD/strikes_*.parquet")
+DATA_PREFIX = 'one-minute/'
+
+
 class BatchProcessor:
     """Main orchestration script for batch processing."""
     
@@ -44,19 +59,75 @@ class BatchProcessor:
         self.function_name = function_name or config.get('lambda', {}).get('function_name', 'spy-history-features')
         self.source_bucket = source_bucket or config.get('s3', {}).get('source_bucket', 'spy-no-history-features')
         self.dest_bucket = dest_bucket or config.get('s3', {}).get('dest_bucket', 'spy-with-history-features')
-        self.max_threads = max_threads or config.get('threading', {}).get('max_threads', 20)
+        self.max_threads = self._resolve_max_threads(max_threads, config)
         self.region = region or config.get('lambda', {}).get('region', 'us-east-1')
+        self.listing_workers = config.get('s3', {}).get('listing_workers', 16)
+        self.manifest_key = config.get('s3', {}).get('manifest_key')
+        
+        # boto3/botocore.config are imported lazily to keep CLI start-up (e.g. --help) fast
+        import boto3
+        from botocore.config import Config
         
         # Configure S3 client with larger connection pool for concurrent operations
         s3_config = Config(
             max_pool_connections=50,  # Increased from default 10
+            tcp_keepalive=True,
             retries={'max_attempts': 3, 'mode': 'adaptive'}
         )
         
         self.s3_client = boto3.client('s3', region_name=self.region, config=s3_config)
-        self.lambda_client = LambdaClient(self.function_name, self.region)
         
-        logger.info(f"BatchProcessor initialized: {self.function_name}, max_threads={self.max_threads} (max_pool_connections=50)")
+        # Shard invocations across several Lambda clients, each with its own
+        # connection pool, handing them out round-robin
+        self.invoker_count = max(1, config.get('lambda', {}).get('invoker_count', 4))
+        # Every thread may be waiting on an invoker, so each pool covers its
+        # share of the threads (a smaller pool blocks them on checkout)
+        self.max_pool_connections = (config.get('lambda', {}).get('max_pool_connections')
+                                     or max(50, -(-self.max_threads // self.invoker_count)))
+        # Optional: invoke asynchronously and collect batch results from this S3 prefix
+        self.result_prefix = config.get('lambda', {}).get('result_prefix')
+        self.invokers = [LambdaClient(self.function_name, self.region, self.result_prefix,
+                                      max_pool_connections=self.max_pool_connections)
+                         for _ in range(self.invoker_count)]
+        self._invoker_counter = itertools.count()
+        
+        # Optionally pre-warm Lambda containers before dispatching real batches
+        self.warmup = config.get('lambda', {}).get('warmup', False)
+        
+        # Shared across all dates: caps Lambda invokes/second while allowing bursts
+        self.rate_limiter = TokenBucket(rate=config.get('lambda', {}).get('invoke_tps', 10))
+        
+        logger.info(f"BatchProcessor initialized: {self.function_name}, max_threads={self.max_threads}, "
+                    f"invokers={self.invoker_count} (max_pool_connections={self.max_pool_connections})")
+    
+    def _next_invoker(self) -> LambdaClient:
+        """Return the next LambdaClient from the invoker pool (round-robin)."""
+        return self.invokers[next(self._invoker_counter) % self.invoker_count]
+    
+    @staticmethod
+    def _resolve_max_threads(max_threads: Optional[int], config: Dict) -> int:
+        """
+        Resolve worker thread count: CLI argument, then SPY_MAX_THREADS env var,
+        then config file, then an IO-bound default of cpu_count * 8.
+        
+        The computed default is clamped to the function's reserved concurrency
+        (lambda.reserved_concurrency), since the invoke rate limiter bounds
+        invokes per second, not invocations in flight. Explicit values are
+        taken as given.
+        
+        Args:
+            max_threads: Value from the command line (None if not given)
+            config: Parsed config.yaml contents
+            
+        Returns:
+            Thread count clamped to [1, MAX_THREADS_CAP]
+        """
+        reserved = config.get('lambda', {}).get('reserved_concurrency') or DEFAULT_RESERVED_CONCURRENCY
+        threads = (max_threads
+                   or os.environ.get('SPY_MAX_THREADS')
+                   or config.get('threading', {}).get('max_threads')
+                   or min((os.cpu_count() or 1) * 8, int(reserved)))
+        return max(1, min(int(threads), MAX_THREADS_CAP))
     
     def _load_config(self, config_path: Optional[str] = None) -> Dict:
         """
@@ -78,6 +149,8 @@ class BatchProcessor:
             logger.warning(f"Config file not found: {config_path}, using defaults")
             return {}
         
+        import yaml
+        
         try:
             with open(config_path, 'r') as f:
                 config = yaml.safe_load(f)
@@ -96,36 +169,43 @@ class BatchProcessor:
         """
         logger.info("Discovering unprocessed files...")
         
-        # List source files
-        source_files = self._list_s3_files(self.source_bucket, 'one-minute/')
-        logger.info(f"Source bucket: {len(source_files)} files")
+        # Destination keys already recorded by a previous run (if any)
+        cached_dest_keys = self._load_manifest()
         
-        # List destination files
-        dest_files = self._list_s3_files(self.dest_bucket, 'one-minute/')
-        logger.info(f"Destination bucket: {len(dest_files)} files")
+        # Stream source keys through the cached destination set, so only
+        # candidate files (not known to be processed) are kept and the full
+        # source listing is never materialized
+        source_dates = self._list_date_prefixes(self.source_bucket, DATA_PREFIX)
+        candidate_keys = self._list_bucket_suffixes(self.source_bucket, DATA_PREFIX, exclude=cached_dest_keys,
+                                                    date_prefixes=source_dates)
         
-        # Find unprocessed (files in source but not in dest)
-        source_keys = {self._extract_key_suffix(f) for f in source_files}
-        dest_keys = {self._extract_key_suffix(f) for f in dest_files}
-        unprocessed_keys = source_keys - dest_keys
+        # Only the date folders holding candidates need reconciling: list the
+        # destination for those folders in full (whatever dates they are), so
+        # retries and backfills of older dates are picked up. Keys without a
+        # date folder are reconciled by the root-level shard of every listing
+        dest_dates = sorted({f"{DATA_PREFIX}{key.partition('/')[0]}/" for key in candidate_keys if '/' in key})
+        new_dest_keys = self._list_bucket_suffixes(self.dest_bucket, DATA_PREFIX, exclude=cached_dest_keys,
+                                                   date_prefixes=dest_dates) if candidate_keys else set()
         
-        logger.info(f"Unprocessed: {len(unprocessed_keys)} files")
+        if cached_dest_keys:
+            logger.info(f"Destination bucket: {len(new_dest_keys)} files not yet in the manifest "
+                        f"({len(dest_dates)} date folders checked)")
+        
+        dest_keys = cached_dest_keys | new_dest_keys
+        self._save_manifest(dest_keys)
+        
+        logger.info(f"Destination bucket: {len(dest_keys)} files")
         
-        # Group by date
-        by_date = defaultdict(list)
-        for key in unprocessed_keys:
-            date = self._extract_date_from_key(key)
-            # key is like "20250729/strikes_202507291611.parquet"
-            # need to add "one-minute/" prefix
-            s3_uri = f"s3://{self.source_bucket}/one-minute/{key}"
-            by_date[date].append(s3_uri)
+        unprocessed_keys = candidate_keys - new_dest_keys
         
-        # Sort URIs within each date chronologically
-        for date in by_date:
-            by_date[date] = sorted(by_date[date])
+        logger.info(f"Unprocessed: {len(unprocessed_keys)} files")
         
-        # Sort dates chronologically
-        sorted_by_date = dict(sorted(by_date.items()))
+        # Group by date; suffixes are "YYYYMMDD/strikes_*.parquet", so sorting
+        # once orders both dates and files within each date chronologically
+        sorted_by_date = defaultdict(list)
+        for key in sorted(unprocessed_keys):
+            sorted_by_date[self._extract_date_from_key(key)].append(f"s3://{self.source_bucket}/{DATA_PREFIX}{key}")
+        sorted_by_date = dict(sorted_by_date)
         
         # Log discovered dates and file counts
         dates_list = sorted(sorted_by_date.keys())
@@ -164,111 +244,248 @@ class BatchProcessor:
             }
         
         # Create thread pool and process dates in chronological order
-        results = []
+        # Aggregated as date results arrive
+        totals = Counter()
+        failed_dates = []
         total_dates = len(unprocessed_by_date)
         
+        # Flatten every (date, batch) pair into one work queue so a large date
+        # no longer holds a worker while small dates finish
+        date_threads = [DateThread(date, uris, self._next_invoker(), batch_size=100, max_retries=3,
+                                   rate_limiter=self.rate_limiter)
+                        for date, uris in unprocessed_by_date.items()]
+        work = ((thread, batch_idx, batch)
+                for thread in date_threads
+                for batch_idx, batch in enumerate(thread.iter_batches()))
+        
+        if self.warmup:
+            self._warmup_lambdas(min(self.max_threads, sum(t.batch_count for t in date_threads)))
+        
         with ThreadPoolExecutor(max_workers=self.max_threads) as executor:
+            # Keep at most max_threads batches in flight; the next batch is only
+            # submitted once a running one completes
             futures = {}
             
-            # Submit dates in chronological order
-            for date, uris in unprocessed_by_date.items():
-                thread = DateThread(date, uris, self.lambda_client)
-                # Process with batch_size=45 (fits within Lambda timeout with extended read timeout)
-                future = executor.submit(thread.process, batch_size= 100, max_retries=3)
-                futures[future] = date
+            def submit_next() -> None:
+                for thread, batch_idx, batch in work:
+                    futures[executor.submit(thread.process_batch, batch_idx, batch)] = thread.date
+                    return
+            
+            # Submit batches in chronological order
+            for _ in range(self.max_threads):
+                submit_next()
             
             # Wait for completion and show progress
             completed_count = 0
-            for future in as_completed(futures):
-                try:
-                    result = future.result()
-                    results.append(result)
-                    completed_count += 1
-                    
-                    # Format result with emoji status
-                    status = "✅" if result['failed'] == 0 else "❌"
-                    files_info = f"{result['completed']} processed"
-                    if result['failed'] > 0:
-                        files_info += f", {result['failed']} failed"
-                    
-                    logger.info(f"{status} [{completed_count}/{total_dates}] {result['date']}: {files_info}")
-                    
-                    # Show errors if any
-                    if result.get('failures'):
-                        for failure in result['failures'][:3]:  # Show first 3 errors
-                            error_msg = failure.get('error', 'Unknown error')
-                            if len(error_msg) > 80:
-                                error_msg = error_msg[:77] + "..."
-                            logger.error(f"   💥 {failure.get('uri', 'Unknown file')}: {error_msg}")
-                        if len(result['failures']) > 3:
-                            logger.error(f"   ... and {len(result['failures']) - 3} more errors")
-                    
-                except Exception as e:
-                    completed_count += 1
-                    date = futures[future]
-                    logger.error(f"❌ [{completed_count}/{total_dates}] {date}: Exception - {str(e)}")
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    date = futures.pop(future)
+                    submit_next()
+                    try:
+                        result = future.result()
+                        if result is None:
+                            # Date still has batches outstanding
+                            continue
+                        
+                        completed_count += 1
+                        totals.update(dates=1, completed=result['completed'], failed=result['failed'])
+                        if result['failed'] > 0:
+                            failed_dates.append(result)
+                        
+                        # Format result with emoji status
+                        status = "✅" if result['failed'] == 0 else "❌"
+                        files_info = f"{result['completed']} processed"
+                        if result['failed'] > 0:
+                            files_info += f", {result['failed']} failed"
+                        
+                        logger.info(f"{status} [{completed_count}/{total_dates}] {result['date']}: {files_info}")
+                        
+                        # Show errors if any
+                        if result.get('failures'):
+                            for failure in result['failures'][:3]:  # Show first 3 errors
+                                error_msg = failure.get('error', 'Unknown error')
+                                if len(error_msg) > 80:
+                                    error_msg = error_msg[:77] + "..."
+                                logger.error(f"   💥 {failure.get('uri', 'Unknown file')}: {error_msg}")
+                            if len(result['failures']) > 3:
+                                logger.error(f"   ... and {len(result['failures']) - 3} more errors")
+                        
+                    except Exception as e:
+                        completed_count += 1
+                        logger.error(f"❌ [{completed_count}/{total_dates}] {date}: Exception - {str(e)}")
         
         # Generate summary
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds()
         
-        summary = self._generate_summary(results, duration)
+        summary = self._generate_summary(totals, failed_dates, duration)
         self._print_summary(summary)
         
         return summary
     
-    def _list_s3_files(self, bucket: str, prefix: str) -> List[str]:
+    def _warmup_lambdas(self, count: int) -> None:
+        """
+        Pre-warm Lambda containers with concurrent no-op pings.
+        
+        The pings overlap, so Lambda initializes up to `count` containers and
+        the first real batches do not pay the cold-start cost.
+        
+        Args:
+            count: Number of concurrent pings (expected concurrent batches)
+        """
+        logger.info(f"Warming up {count} Lambda containers...")
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            list(executor.map(lambda _: self._next_invoker().warmup(), range(count)))
+    
+    def _load_manifest(self) -> Set[str]:
+        """
+        Load the cached destination key manifest from the destination bucket.
+        
+        The manifest assumes the destination bucket is append-only: keys
+        deleted since it was written are still treated as processed. Set
+        s3.manifest_key to null to always list the full bucket.
+        
+        Returns:
+            Cached key suffixes; empty if no manifest
+        """
+        if not self.manifest_key:
+            return set()
+        
+        try:
+            response = self.s3_client.get_object(Bucket=self.dest_bucket, Key=self.manifest_key)
+            manifest = json.loads(gzip.decompress(response['Body'].read()))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code', '') not in ['NoSuchKey', '404']:
+                logger.warning(f"Failed to load manifest s3://{self.dest_bucket}/{self.manifest_key}: {e}")
+            return set()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable manifest s3://{self.dest_bucket}/{self.manifest_key}: {e}")
+            return set()
+        
+        keys = set(manifest.get('keys', []))
+        logger.info(f"Loaded manifest: {len(keys)} destination files")
+        return keys
+    
+    def _save_manifest(self, dest_keys: Set[str]) -> None:
+        """
+        Persist the destination key suffixes as a gzip'd JSON manifest.
+        
+        Args:
+            dest_keys: All known destination key suffixes
+        """
+        if not self.manifest_key or not dest_keys:
+            return
+        
+        sorted_keys = sorted(dest_keys)
+        manifest = {'keys': sorted_keys}
+        body = gzip.compress(json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+        
+        try:
+            self.s3_client.upload_fileobj(
+                io.BytesIO(body), self.dest_bucket, self.manifest_key,
+                ExtraArgs={'ContentType': 'application/json', 'ContentEncoding': 'gzip'}
+            )
+            logger.info(f"Saved manifest: {len(sorted_keys)} files ({len(body)} bytes)")
+        except ClientError as e:
+            logger.warning(f"Failed to save manifest s3://{self.dest_bucket}/{self.manifest_key}: {e}")
+    
+    def _list_bucket_suffixes(self, bucket: str, prefix: str,
+                              exclude: Optional[Set[str]] = None,
+                              date_prefixes: Optional[List[str]] = None) -> Set[str]:
         """
-        List all files in S3 bucket with prefix.
+        List all parquet key suffixes under a prefix, sharded by date folder.
+        
+        Pagination is sequential per prefix, so each date folder
+        (e.g. "one-minute/20250724/") is listed in parallel and the results
+        are merged into one set. Files directly under the prefix are listed
+        as one more shard (a delimited listing, which excludes the folders).
         
         Args:
             bucket: S3 bucket name
             prefix: Key prefix
+            exclude: Suffixes to drop while streaming (e.g. already-processed keys)
+            date_prefixes: Date folders to list (default: discovered under prefix)
         
         Returns:
-            List of S3 keys
+            Set of key suffixes
         """
-        keys = []
-        paginator = self.s3_client.get_paginator('list_objects_v2')
+        exclude = exclude or set()
         
-        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-            if 'Contents' in page:
-                for obj in page['Contents']:
-                    key = obj['Key']
-                    # Only include parquet files
-                    if key.endswith('.parquet'):
-                        keys.append(key)
+        def list_shard(shard: Tuple[str, Optional[str]]) -> List[str]:
+            shard_prefix, delimiter = shard
+            return [k for k in self._iter_s3_suffixes(bucket, shard_prefix, delimiter) if k not in exclude]
         
-        return keys
+        if date_prefixes is None:
+            date_prefixes = self._list_date_prefixes(bucket, prefix)
+        shards = [(p, None) for p in date_prefixes] + [(prefix, '/')]
+        
+        suffixes = set()
+        with ThreadPoolExecutor(max_workers=self.listing_workers) as executor:
+            for shard in executor.map(list_shard, shards):
+                suffixes.update(shard)
+        
+        logger.debug(f"Listed {len(suffixes)} files across {len(date_prefixes)} date prefixes in {bucket}")
+        return suffixes
+    
+    def _list_date_prefixes(self, bucket: str, prefix: str) -> List[str]:
+        """
+        List the top-level date folders under a prefix.
+        
+        Args:
+            bucket: S3 bucket name
+            prefix: Key prefix
+        
+        Returns:
+            List of folder prefixes, e.g. ["one-minute/20250724/", ...]
+        """
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        pages = paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/')
+        
+        return [p for p in pages.search('CommonPrefixes[].Prefix') if p is not None]
     
-    def _extract_key_suffix(self, key: str) -> str:
-        """Extract the date/filename portion of the key."""
-        # e.g., "one-minute/20250724/strikes_202507240931.parquet" -> "20250724/strikes_202507240931.parquet"
-        parts = key.split('/', 1)
-        if len(parts) == 2:
-            return parts[1]
-        return key
+    def _iter_s3_suffixes(self, bucket: str, prefix: str, delimiter: Optional[str] = None) -> Iterator[str]:
+        """
+        Stream parquet keys under a prefix as date/filename suffixes.
+        
+        The '.parquet' filter is pushed into the paginator via JMESPath, and
+        keys are yielded one at a time so callers can build sets directly.
+        
+        Args:
+            bucket: S3 bucket name
+            prefix: Key prefix
+            delimiter: Optional delimiter; '/' lists only keys directly under prefix
+        
+        Yields:
+            Key suffixes, e.g. "20250724/strikes_202507240931.parquet"
+        """
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        params = {'Bucket': bucket, 'Prefix': prefix}
+        if delimiter:
+            params['Delimiter'] = delimiter
+        pages = paginator.paginate(**params)
+        root_len = len(DATA_PREFIX)
+        
+        for key in pages.search("Contents[?ends_with(Key, '.parquet')].Key"):
+            # Pages without 'Contents' yield None
+            if key is None:
+                continue
+            # e.g., "one-minute/20250724/strikes_202507240931.parquet" -> "20250724/strikes_202507240931.parquet"
+            yield key[root_len:]
     
     def _extract_date_from_key(self, key: str) -> str:
         """Extract date from S3 key."""
         # e.g., "20250724/strikes_202507240931.parquet" -> "20250724"
-        parts = key.split('/')
-        if len(parts) >= 2:
-            return parts[0]
-        return 'unknown'
+        date, sep, _ = key.partition('/')
+        return date if sep else 'unknown'
     
-    def _generate_summary(self, results: List[Dict], duration: float) -> Dict:
-        """Generate summary report from results."""
-        total_completed = sum(r['completed'] for r in results)
-        total_failed = sum(r['failed'] for r in results)
-        
-        failed_dates = [r for r in results if r['failed'] > 0]
-        
+    def _generate_summary(self, totals: Counter, failed_dates: List[Dict], duration: float) -> Dict:
+        """Generate summary report from aggregated date results."""
         return {
-            'status': 'success' if total_failed == 0 else 'partial',
-            'dates_processed': len(results),
-            'files_processed': total_completed,
-            'files_failed': total_failed,
+            'status': 'success' if totals['failed'] == 0 else 'partial',
+            'dates_processed': totals['dates'],
+            'files_processed': totals['completed'],
+            'files_failed': totals['failed'],
             'duration_seconds': duration,
             'failed_dates': failed_dates
         }
@@ -331,7 +548,7 @@ Examples:
     parser.add_argument('--dest-bucket',
                        help='Destination S3 bucket (overrides config file)')
     parser.add_argument('--threads', type=int,
-                       help='Maximum concurrent threads (overrides config file)')
+                       help='Maximum concurrent threads (overrides SPY_MAX_THREADS and config file)')
     parser.add_argument('--region',
                        help='AWS region (overrides config file)')
     parser.add_argument('--log-level', default='INFO',
@@ -11,7 +11,7 @@ Write-Host $separator -ForegroundColor Cyan
 Write-Host ""
 
 # Step 1: Clean previous build
-Write-Host "[1/2] Cleaning previous build..." -ForegroundColor Yellow
+Write-Host "[1/3] Cleaning previous build..." -ForegroundColor Yellow
 if (Test-Path ".aws-sam") {
     Remove-Item -Recurse -Force ".aws-sam"
     Write-Host "Removed .aws-sam directory" -ForegroundColor Gray
@@ -19,7 +19,7 @@ if (Test-Path ".aws-sam") {
 Write-Host ""
 
 # Step 2: Build with SAM
-Write-Host "[2/2] Building SAM application..." -ForegroundColor Yellow
+Write-Host "[2/3] Building SAM application..." -ForegroundColor Yellow
 Write-Host ""
 
 sam build --template-file template.yaml
@@ -30,6 +30,24 @@ if ($LASTEXITCODE -ne 0) {
     exit 1
 }
 
+Write-Host ""
+
+# Step 3: Precompile bytecode
+# /var/task is read-only, so without shipped .pyc files every cold start
+# compiles all modules again. unchecked-hash bytecode is used without
+# comparing source timestamps, which zip packaging does not preserve exactly.
+# Only bytecode from the runtime's Python version (3.11) is picked up; rebuild
+# after any code change
+Write-Host "[3/3] Precompiling Python bytecode..." -ForegroundColor Yellow
+
+python -m compileall -q --invalidation-mode unchecked-hash ".aws-sam/build/HistoryFeaturesFunction"
+
+if ($LASTEXITCODE -ne 0) {
+    Write-Host ""
+    Write-Host "ERROR: Bytecode compilation failed" -ForegroundColor Red
+    exit 1
+}
+
 Write-Host ""
 Write-Host $separator -ForegroundColor Cyan
 Write-Host "Build Complete!" -ForegroundColor Green
@@ -1,18 +1,47 @@
 """Date thread for processing files for a single date."""
 
+import itertools
 import logging
+import math
+import random
+import threading
 import time
-from typing import Dict, List, Any
+from typing import Dict, Iterable, Iterator, List, Any, Optional
 
 from lambda_client import LambdaClient
+from rate_limiter import TokenBucket
 
 logger = logging.getLogger(__name__)
 
 
+def chunks(seq: Iterable[str], n: int) -> Iterator[List[str]]:
+    """
+    Lazily split a sequence into lists of at most n items.
+    
+    Args:
+        seq: Items to split
+        n: Chunk size
+    
+    Yields:
+        Consecutive chunks of seq
+    """
+    it = iter(seq)
+    return iter(lambda: list(itertools.islice(it, n)), [])
+
+
 class DateThread:
-    """Thread for processing all files for a single date."""
+    """
+    Tracks processing of all files for a single date.
+    
+    Batches are processed independently (process_batch may be called from
+    several worker threads at once); per-date totals are merged under a lock,
+    and whichever call completes the date's last batch runs the retry pass for
+    unprocessed files and returns the date result.
+    """
     
-    def __init__(self, date: str, s3_uris: List[str], lambda_client: LambdaClient):
+    def __init__(self, date: str, s3_uris: List[str], lambda_client: LambdaClient,
+                 batch_size: int = 45, max_retries: int = 3,
+                 rate_limiter: Optional[TokenBucket] = None):
         """
         Initialize DateThread.
         
@@ -20,20 +49,84 @@ class DateThread:
             date: Date string (YYYYMMDD)
             s3_uris: List of S3 URIs for this date (chronologically sorted)
             lambda_client: LambdaClient instance for invoking Lambda
+            batch_size: Number of files per Lambda invocation (default: 45)
+            max_retries: Maximum retry attempts for failed batches (default: 3)
+            rate_limiter: Shared TokenBucket throttling invocations (default: none)
         """
         self.date = date
         self.s3_uris = s3_uris
         self.lambda_client = lambda_client
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter
+        
+        # Batches are generated lazily (see iter_batches); only the count is kept
+        self.batch_count = math.ceil(len(s3_uris) / batch_size)
+        
+        # Track results (guarded by _lock)
+        self._lock = threading.Lock()
+        self._remaining = self.batch_count
+        self.total_success = 0
+        self.total_failed = 0
+        self.all_failures = []
+        self.pending_files = []
+        
+        logger.debug(f"DateThread created for {date} with {len(s3_uris)} files in {self.batch_count} batches")
+    
+    def iter_batches(self) -> Iterator[List[str]]:
+        """
+        Yield this date's files in batches of batch_size.
         
-        logger.debug(f"DateThread created for {date} with {len(s3_uris)} files")
+        Yields:
+            Lists of S3 URIs
+        """
+        return chunks(self.s3_uris, self.batch_size)
     
-    def process(self, batch_size: int = 45, max_retries: int = 3) -> Dict[str, Any]:
+    def process_batch(self, batch_idx: int, batch: List[str]) -> Optional[Dict[str, Any]]:
         """
-        Process all files for this date by invoking Lambda in batches.
+        Invoke Lambda for one batch of this date, with retries.
+        
+        Safe to call concurrently for different batches of the same date.
         
         Args:
-            batch_size: Number of files per Lambda invocation (default: 45)
-            max_retries: Maximum retry attempts for failed batches (default: 3)
+            batch_idx: Index of the batch within iter_batches()
+            batch: S3 URIs in the batch
+        
+        Returns:
+            Date result dictionary if this was the date's last outstanding
+            batch, otherwise None
+        """
+        logger.info(f"Date {self.date}: Processing batch {batch_idx + 1}/{self.batch_count} ({len(batch)} files)")
+        
+        error = None
+        try:
+            response = self._invoke_with_retries(batch, f"batch {batch_idx + 1}")
+        except Exception as e:
+            logger.error(f"Date {self.date} batch {batch_idx + 1}: Failed after {self.max_retries} attempts")
+            error = e
+        
+        with self._lock:
+            if error is not None:
+                # Max retries reached, mark all files in this batch as failed
+                self._record_failed(batch, error)
+            else:
+                # Batch succeeded (even if some files failed)
+                unprocessed = self._record_response(response)
+                
+                # Add unprocessed files to pending for retry
+                if unprocessed:
+                    logger.warning(f"Date {self.date} batch {batch_idx + 1}: {len(unprocessed)} files unprocessed, will retry later")
+                    self.pending_files.extend(unprocessed)
+            
+            self._remaining -= 1
+            if self._remaining > 0:
+                return None
+        
+        return self._finish()
+    
+    def _finish(self) -> Dict[str, Any]:
+        """
+        Retry unprocessed files and build the date result.
         
         Returns:
             Result dictionary with:
@@ -41,136 +134,143 @@ class DateThread:
                 - completed: Number of successfully processed files
                 - failed: Number of failed files
                 - failures: List of failure details (if any)
-        
-        Raises:
-            Exception: If Lambda invocation fails after retries
         """
-        logger.info(f"Processing date {self.date}: {len(self.s3_uris)} files in batches of {batch_size}")
-        
-        # Split files into batches
-        batches = [self.s3_uris[i:i + batch_size] for i in range(0, len(self.s3_uris), batch_size)]
-        logger.info(f"Date {self.date}: Split into {len(batches)} batches")
-        
-        # Track results
-        total_success = 0
-        total_failed = 0
-        all_failures = []
-        pending_files = []
-        
-        # Process each batch with retry logic
-        for batch_idx, batch in enumerate(batches):
-            logger.info(f"Date {self.date}: Processing batch {batch_idx + 1}/{len(batches)} ({len(batch)} files)")
-            
-            # Add delay between batches to avoid rate limiting (except for first batch)
-            if batch_idx > 0:
-                time.sleep(0.5)  # 500ms delay between Lambda invocations
-            
-            # Try to process this batch with retries
-            batch_success = False
-            batch_attempt = 0
-            
-            while not batch_success and batch_attempt < max_retries:
-                try:
-                    if batch_attempt > 0:
-                        logger.info(f"Date {self.date} batch {batch_idx + 1}: Retry attempt {batch_attempt}/{max_retries - 1}")
-                        time.sleep(2 ** batch_attempt)  # Exponential backoff: 2s, 4s, 8s
-                    
-                    # Invoke Lambda with this batch
-                    response = self.lambda_client.invoke_batch(batch)
-                    
-                    # Extract results
-                    success_count = response.get('success_count', 0)
-                    failure_count = response.get('failure_count', 0)
-                    failures = response.get('failures', [])
-                    unprocessed = response.get('unprocessed_files', [])
-                    
-                    # Update totals
-                    total_success += success_count
-                    total_failed += failure_count
-                    all_failures.extend(failures)
-                    
-                    # Add unprocessed files to pending for retry
-                    if unprocessed:
-                        logger.warning(f"Date {self.date} batch {batch_idx + 1}: {len(unprocessed)} files unprocessed, will retry later")
-                        pending_files.extend(unprocessed)
-                    
-                    # Batch succeeded (even if some files failed)
-                    batch_success = True
-                    
-                except Exception as e:
-                    batch_attempt += 1
-                    logger.error(f"Date {self.date} batch {batch_idx + 1} attempt {batch_attempt} failed: {e}")
-                    
-                    if batch_attempt >= max_retries:
-                        # Max retries reached, mark all files in this batch as failed
-                        logger.error(f"Date {self.date} batch {batch_idx + 1}: Failed after {max_retries} attempts")
-                        total_failed += len(batch)
-                        for uri in batch:
-                            all_failures.append({
-                                'uri': uri,
-                                'error': str(e),
-                                'error_type': type(e).__name__
-                            })
-                        break
-        
         # Retry unprocessed files (files that Lambda returned as unprocessed)
         retry_count = 0
-        while pending_files and retry_count < max_retries:
+        while self.pending_files and retry_count < self.max_retries:
             retry_count += 1
-            logger.info(f"Date {self.date}: Retry {retry_count}/{max_retries} for {len(pending_files)} unprocessed files")
+            logger.info(f"Date {self.date}: Retry {retry_count}/{self.max_retries} for {len(self.pending_files)} unprocessed files")
+            time.sleep(self._backoff(retry_count))
             
             # Split pending files into batches
-            retry_batches = [pending_files[i:i + batch_size] for i in range(0, len(pending_files), batch_size)]
-            pending_files = []  # Clear pending list
+            retry_batches = chunks(self.pending_files, self.batch_size)
+            self.pending_files = []  # Clear pending list
             
             for retry_batch_idx, retry_batch in enumerate(retry_batches):
-                # Add delay between retry batches
-                if retry_batch_idx > 0:
-                    time.sleep(0.5)
-                
                 try:
-                    response = self.lambda_client.invoke_batch(retry_batch)
-                    
-                    total_success += response.get('success_count', 0)
-                    total_failed += response.get('failure_count', 0)
-                    all_failures.extend(response.get('failures', []))
+                    response = self._invoke_with_retries(retry_batch, f"retry batch {retry_batch_idx + 1}")
                     
                     # Add any still-unprocessed files back to pending
-                    unprocessed = response.get('unprocessed_files', [])
-                    if unprocessed:
-                        pending_files.extend(unprocessed)
+                    self.pending_files.extend(self._record_response(response))
                         
                 except Exception as e:
                     # Retry batch failed, mark all files as failed
                     logger.error(f"Date {self.date} retry batch {retry_batch_idx + 1} failed: {e}")
-                    total_failed += len(retry_batch)
-                    for uri in retry_batch:
-                        all_failures.append({
-                            'uri': uri,
-                            'error': str(e),
-                            'error_type': type(e).__name__
-                        })
+                    self._record_failed(retry_batch, e)
         
         # Mark any remaining unprocessed files as failed
-        if pending_files:
-            logger.error(f"Date {self.date}: {len(pending_files)} files still unprocessed after {max_retries} retries")
-            total_failed += len(pending_files)
-            for uri in pending_files:
-                all_failures.append({
+        if self.pending_files:
+            logger.error(f"Date {self.date}: {len(self.pending_files)} files still unprocessed after {self.max_retries} retries")
+            self.total_failed += len(self.pending_files)
+            for uri in self.pending_files:
+                self.all_failures.append({
                     'uri': uri,
-                    'error': f'Unprocessed after {max_retries} retries',
+                    'error': f'Unprocessed after {self.max_retries} retries',
                     'error_type': 'MaxRetriesExceeded'
                 })
         
         # Return result summary
         result = {
             'date': self.date,
-            'completed': total_success,
-            'failed': total_failed,
-            'failures': all_failures
+            'completed': self.total_success,
+            'failed': self.total_failed,
+            'failures': self.all_failures
         }
         
         logger.info(f"Date {self.date} complete: {result['completed']} succeeded, "
                    f"{result['failed']} failed")
         
         return result
+    
+    def _invoke_with_retries(self, batch: List[str], label: str) -> Dict[str, Any]:
+        """
+        Invoke Lambda for a batch, retrying failed attempts with backoff.
+        
+        Args:
+            batch: S3 URIs to process
+            label: Batch description for log messages
+        
+        Returns:
+            Lambda batch result
+        
+        Raises:
+            Exception: The last invocation error once max_retries attempts fail
+        """
+        for attempt in range(self.max_retries):
+            if attempt > 0:
+                logger.info(f"Date {self.date} {label}: Retry attempt {attempt}/{self.max_retries - 1}")
+                time.sleep(self._backoff(attempt))
+            
+            try:
+                return self._invoke(batch)
+            except Exception as e:
+                logger.error(f"Date {self.date} {label} attempt {attempt + 1} failed: {e}")
+                if attempt == self.max_retries - 1:
+                    raise
+    
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """
+        Full-jitter exponential backoff delay.
+        
+        Randomizing the whole interval keeps threads that failed together
+        from retrying in lockstep.
+        
+        Args:
+            attempt: Retry attempt number (1-based)
+        
+        Returns:
+            Delay in seconds, uniform in [0, min(2 ** attempt, 30)]
+        """
+        return random.uniform(0, min(2 ** attempt, 30))
+    
+    def _record_response(self, response: Dict[str, Any]) -> List[str]:
+        """
+        Add a Lambda batch response to the date totals.
+        
+        Args:
+            response: Lambda batch result
+        
+        Returns:
+            Files the Lambda left unprocessed
+        """
+        self.total_success += response.get('success_count', 0)
+        self.total_failed += response.get('failure_count', 0)
+        self.all_failures.extend(response.get('failures', []))
+        return response.get('unprocessed_files', [])
+    
+    def _record_failed(self, batch: List[str], error: Exception) -> None:
+        """
+        Mark every file in a batch as failed with the given error.
+        
+        Args:
+            batch: S3 URIs in the failed batch
+            error: Exception that caused the failure
+        """
+        self.total_failed += len(batch)
+        for uri in batch:
+            self.all_failures.append({
+                'uri': uri,
+                'error': str(error),
+                'error_type': type(error).__name__
+            })
+    
+    def _invoke(self, batch: List[str]) -> Dict[str, Any]:
+        """
+        Invoke Lambda for one batch and wait for its result.
+        
+        Uses async dispatch + S3 result collection when the client has a
+        result_prefix, otherwise a synchronous RequestResponse invoke.
+        
+        Args:
+            batch: S3 URIs to process
+        
+        Returns:
+            Lambda batch result
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        
+        if self.lambda_client.result_prefix:
+            return self.lambda_client.fetch_result(self.lambda_client.dispatch_batch(batch))
+        return self.lambda_client.invoke_batch(batch)
@@ -2,9 +2,10 @@
 
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, Optional
 
 if TYPE_CHECKING:
     from history_manager import HistoryManager
@@ -16,15 +17,24 @@ logger = logging.getLogger(__name__)
 class FeatureEngine:
     """Orchestrates feature computation using the feature registry."""
     
-    def __init__(self, registry: 'FeatureRegistry'):
+    # Decimals every section rounds its feature arrays to (see FeatureSection.compute)
+    FEATURE_DECIMALS = 4
+    
+    def __init__(self, registry: 'FeatureRegistry', max_workers: int = 1):
         """
         Initialize FeatureEngine.
         
         Args:
             registry: FeatureRegistry instance
+            max_workers: Threads used to compute sections concurrently
+                (default: 1, sequential)
         """
         self.registry = registry
-        logger.info("FeatureEngine initialized")
+        self.max_workers = max(1, max_workers)
+        # Section thread pool, created on first parallel use and reused for
+        # every minute the engine processes
+        self._executor: Optional[ThreadPoolExecutor] = None
+        logger.info(f"FeatureEngine initialized (max_workers={self.max_workers})")
     
     def compute_features(self, df: pd.DataFrame, history_mgr: 'HistoryManager', 
                         filename: str) -> pd.DataFrame:
@@ -37,31 +47,49 @@ class FeatureEngine:
             filename: Source filename for context
         
         Returns:
-            DataFrame with computed features added
+            New DataFrame: input columns followed by all computed features
         """
         start_time = time.time()
-        df_result = df.copy()
-        
-        initial_col_count = len(df_result.columns)
-        
-        # Apply all enabled sections
-        for section_name in sorted(self.registry.enabled_sections):
-            section = self.registry.sections[section_name]
-            logger.info(f"Applying section: {section_name}")
-            
-            section_start = time.time()
-            df_result = section.compute(df_result, history_mgr, filename=filename)
-            section_elapsed = (time.time() - section_start) * 1000
-            
-            # Count features added by this section
-            current_col_count = len(df_result.columns)
-            features_added = current_col_count - initial_col_count
-            initial_col_count = current_col_count
-            
-            logger.info(
-                f"Section {section_name} completed in {section_elapsed:.2f}ms, "
-                f"added {features_added} features"
-            )
+        
+        # Sections only read df and history and write disjoint output columns,
+        # so they can run concurrently; each gets its own buffer so the merged
+        # column order stays deterministic. Within a section, legs and lags are
+        # already fused into single NumPy calls, so sections are the unit of
+        # parallelism
+        section_names = sorted(self.registry.enabled_sections)
+        section_outs = {name: {} for name in section_names}
+        
+        if self.max_workers > 1 and len(section_names) > 1:
+            executor = self._get_executor()
+            futures = [
+                executor.submit(self._apply_section, name, df, history_mgr, section_outs[name], filename)
+                for name in section_names
+            ]
+            for future in futures:
+                future.result()
+        else:
+            for name in section_names:
+                self._apply_section(name, df, history_mgr, section_outs[name], filename)
+        
+        # Sections write their feature arrays into buffers; the input is never
+        # copied per section
+        out = {}
+        for name in section_names:
+            out.update(section_outs[name])
+        
+        if not out:
+            return df.copy()
+        
+        features = pd.DataFrame(out, index=df.index, copy=False)
+        
+        # Join all features onto the input once instead of per-column inserts.
+        # Feature columns already present in the input keep their position and
+        # are overwritten on the joined frame, which is already a new frame,
+        # so the input is not copied a second time
+        overlap = [col for col in features.columns if col in df.columns]
+        df_result = pd.concat([df, features.drop(columns=overlap)], axis=1)
+        if overlap:
+            df_result[overlap] = features[overlap]
         
         elapsed_ms = (time.time() - start_time) * 1000
         total_features = len(df_result.columns) - len(df.columns)
@@ -72,25 +100,69 @@ class FeatureEngine:
         
         return df_result
     
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Return the section thread pool, creating it on first use.
+        
+        The pool lives as long as the engine, so threads are started once per
+        invocation rather than once per minute.
+        
+        Returns:
+            ThreadPoolExecutor with max_workers threads
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='section')
+        return self._executor
+    
+    def _apply_section(self, section_name: str, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                       out: Dict[str, np.ndarray], filename: str) -> None:
+        """
+        Compute one section into its output buffer, logging its timing.
+        
+        Args:
+            section_name: Registered section name
+            df: Input DataFrame for current minute
+            history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer for this section
+            filename: Source filename for context
+        """
+        section = self.registry.sections[section_name]
+        logger.info(f"Applying section: {section_name}")
+        
+        section_start = time.time()
+        section.compute(df, history_mgr, out=out, filename=filename)
+        section_elapsed = (time.time() - section_start) * 1000
+        
+        logger.info(
+            f"Section {section_name} completed in {section_elapsed:.2f}ms, "
+            f"added {len(out)} features"
+        )
+    
     def round_numerics(self, df: pd.DataFrame, decimals: int = 4) -> pd.DataFrame:
         """
-        Round all numeric columns to configured precision.
+        Round all float columns to configured precision, in place.
+        
+        Columns are grouped by dtype so each group is rounded with a single
+        np.around call over one contiguous array; integer columns are already
+        exact and are left untouched. Active feature columns are skipped when
+        decimals is at least FEATURE_DECIMALS, since the sections already
+        rounded them in place in their output buffers.
         
         Args:
-            df: Input DataFrame
+            df: Input DataFrame (modified in place)
             decimals: Number of decimal places (default: 4)
         
         Returns:
-            DataFrame with rounded numeric values
+            The same DataFrame, with rounded float values
         """
-        df_result = df.copy()
-        
-        # Select numeric columns
-        numeric_cols = df_result.select_dtypes(include=[np.number]).columns
+        float_dtypes = df.dtypes[[pd.api.types.is_float_dtype(dtype) for dtype in df.dtypes]]
+        if decimals >= self.FEATURE_DECIMALS:
+            float_dtypes = float_dtypes.drop(self.registry.get_active_features(), errors='ignore')
         
-        # Round numeric columns
-        df_result[numeric_cols] = df_result[numeric_cols].round(decimals)
+        for dtype in float_dtypes.unique():
+            cols = float_dtypes.index[float_dtypes == dtype]
+            df[cols] = np.around(df[cols].to_numpy(dtype=dtype), decimals)
         
-        logger.info(f"Rounded {len(numeric_cols)} numeric columns to {decimals} decimals")
+        logger.info(f"Rounded {len(float_dtypes)} float columns to {decimals} decimals")
         
-        return df_result
+        return df
@@ -0,0 +1,73 @@
+"""Integer contract keys shared by the per-contract history lookups."""
+
+import numpy as np
+import pandas as pd
+from typing import Optional, Tuple
+
+# Strikes are keyed in thousandths; the low 32 bits hold the scaled strike
+STRIKE_SCALE = 1000
+STRIKE_BITS = 32
+
+# Key of rows whose expiry or strike is missing or unparseable; never matched
+INVALID_KEY = -1
+
+# HistoryManager derived-value key for the per-minute expiry factorization
+EXPIRY_CODES_KEY = 'expiry_codes'
+
+
+def expiry_codes(df: pd.DataFrame) -> Tuple[np.ndarray, pd.Index]:
+    """
+    Factorize the expirDate column of a minute.
+
+    Sections memoize the result per minute (HistoryManager.get_current_derived
+    with EXPIRY_CODES_KEY), so the string expiry column is hashed once per
+    minute and every expiry grouping and contract key works on integer codes.
+
+    Args:
+        df: Minute DataFrame with an expirDate column
+
+    Returns:
+        Tuple of (codes, expiries): an intp code per row (-1 where the expiry
+        is missing) and the Index of distinct expiries in order of appearance
+
+    Raises:
+        KeyError: If expirDate is missing from df
+    """
+    codes, uniques = df['expirDate'].factorize(sort=False)
+    return codes, pd.Index(uniques)
+
+
+def contract_keys(df: pd.DataFrame,
+                  expiries: Optional[Tuple[np.ndarray, pd.Index]] = None) -> np.ndarray:
+    """
+    Compute an int64 (expirDate, strike) key per row.
+
+    The key is (expiry day number << 32) | round(strike * 1000), so lookups
+    across minutes hash plain integers instead of (object, float) tuples.
+    Expiries are parsed once per distinct value; equal dates in different
+    string forms and strikes equal to 1/1000 map to the same key.
+
+    Args:
+        df: Minute DataFrame with expirDate and strike columns
+        expiries: Expiry factorization of df, if already computed (see
+            expiry_codes)
+
+    Returns:
+        int64 array of len(df) keys; INVALID_KEY where the expiry or strike
+        is missing, unparseable or out of range
+
+    Raises:
+        KeyError: If expirDate or strike is missing from df
+    """
+    codes, uniques = expiry_codes(df) if expiries is None else expiries
+    expiry_days = pd.to_datetime(uniques, errors='coerce').to_numpy().astype('datetime64[D]')
+    valid_expiry = ~np.isnat(expiry_days)
+
+    strike = np.round(df['strike'].to_numpy(dtype=np.float64) * STRIKE_SCALE)
+    valid = (codes >= 0) & (strike >= 0) & (strike < 2 ** STRIKE_BITS)
+    valid[valid] = valid_expiry[codes[valid]]
+
+    keys = np.full(len(df), INVALID_KEY, dtype=np.int64)
+    days = expiry_days.astype(np.int64)
+    keys[valid] = (days[codes[valid]] << STRIKE_BITS) | strike[valid].astype(np.int64)
+    return keys
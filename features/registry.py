@@ -3,7 +3,8 @@
 import logging
 import hashlib
 from abc import ABC, abstractmethod
-from typing import List, Dict, TYPE_CHECKING
+from typing import List, Dict, Optional, TYPE_CHECKING
+import numpy as np
 import pandas as pd
 
 if TYPE_CHECKING:
@@ -22,17 +23,22 @@ class FeatureSection(ABC):
         pass
     
     @abstractmethod
-    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager', **kwargs) -> pd.DataFrame:
+    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                out: Dict[str, np.ndarray], **kwargs) -> None:
         """
         Compute all features in this section using historical data.
         
+        Sections must not modify or copy df; they write one array per feature
+        into the shared out buffer, which the engine joins onto the input in
+        a single concat.
+        
         Args:
-            df: Input DataFrame for current minute
+            df: Input DataFrame for current minute (source columns only, read-only)
             history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer; receives feature name -> float array (float64,
+                or float32 where the section documents it) of len(df) values
+                rounded to 4 decimals, in feature_names order
             **kwargs: Additional context (filename, etc.)
-        
-        Returns:
-            DataFrame with computed features added
         """
         pass
 
@@ -44,6 +50,8 @@ class FeatureRegistry:
         """Initialize FeatureRegistry."""
         self.sections: Dict[str, FeatureSection] = {}
         self.enabled_sections: set = set()
+        # Cached compute_version_hash() result; reset whenever sections change
+        self._version_hash: Optional[str] = None
         logger.info("FeatureRegistry initialized")
     
     def register_section(self, name: str, section: FeatureSection) -> None:
@@ -55,6 +63,7 @@ class FeatureRegistry:
             section: FeatureSection instance
         """
         self.sections[name] = section
+        self._version_hash = None
         logger.info(f"Registered section: {name}")
     
     def enable_section(self, name: str) -> None:
@@ -70,6 +79,7 @@ class FeatureRegistry:
         if name not in self.sections:
             raise ValueError(f"Section '{name}' is not registered")
         self.enabled_sections.add(name)
+        self._version_hash = None
         logger.info(f"Enabled section: {name}")
     
     def disable_section(self, name: str) -> None:
@@ -80,6 +90,7 @@ class FeatureRegistry:
             name: Section name
         """
         self.enabled_sections.discard(name)
+        self._version_hash = None
         logger.info(f"Disabled section: {name}")
     
     def get_active_features(self) -> List[str]:
@@ -99,13 +110,19 @@ class FeatureRegistry:
         """
         Generate SHA256 hash of enabled features.
         
+        The hash is cached until a section is registered, enabled or disabled.
+        
         Returns:
             SHA256 hash string (first 16 characters)
         """
+        if self._version_hash is not None:
+            return self._version_hash
+        
         active_features = self.get_active_features()
         # Sort features for consistent hashing
         sorted_features = sorted(active_features)
         # Create hash from concatenated feature names
         feature_string = ','.join(sorted_features)
         hash_obj = hashlib.sha256(feature_string.encode('utf-8'))
-        return hash_obj.hexdigest()[:16]
+        self._version_hash = hash_obj.hexdigest()[:16]
+        return self._version_hash
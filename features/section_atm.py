@@ -3,8 +3,10 @@
 import logging
 import pandas as pd
 import numpy as np
-from typing import TYPE_CHECKING, Optional, Dict
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from .contract_keys import EXPIRY_CODES_KEY, expiry_codes
 from .registry import FeatureSection
+from .window_stats import merged_zscore
 
 if TYPE_CHECKING:
     from ..history_manager import HistoryManager
@@ -29,267 +31,231 @@ class SectionATMFeatures(FeatureSection):
             'ATM_CallGammaChange_L1', 'ATM_CallGammaChange_L5', 'ATM_CallGammaChange_L15'
         ]
     
-    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager', **kwargs) -> pd.DataFrame:
+    # Columns read from the ATM row of each expiry
+    ATM_COLUMNS = ('CallIVMid', 'CallSpreadPct', 'CallGamma')
+    
+    # Lag change features: (feature prefix, ATM column)
+    CHANGE_FEATURES = (
+        ('ATM_CallIVChange', 'CallIVMid'),
+        ('ATM_CallSpreadPctChange', 'CallSpreadPct'),
+        ('ATM_CallGammaChange', 'CallGamma'),
+    )
+    LAGS = (1, 5, 15)
+    ZSCORE_WINDOWS = (5, 15, 30)
+    
+    # HistoryManager derived-value key for per-minute ATM snapshots
+    ATM_CACHE_KEY = 'atm_snapshot'
+    
+    def __init__(self):
+        """Build the output-column dispatch tables once (feature list is fixed)."""
+        self._feature_names = self.feature_names
+        col = {name: i for i, name in enumerate(self._feature_names)}
+        
+        # Output column of each change feature, (LAGS, CHANGE_FEATURES)
+        self._change_dispatch = np.array(
+            [[col[f'{prefix}_L{lag}'] for prefix, _ in self.CHANGE_FEATURES] for lag in self.LAGS],
+            dtype=np.intp
+        )
+        # Output column of each z-score feature, in ZSCORE_WINDOWS order
+        self._zscore_dispatch = np.array(
+            [col[f'ATM_CallIVZ_{window}'] for window in self.ZSCORE_WINDOWS],
+            dtype=np.intp
+        )
+    
+    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                out: Dict[str, np.ndarray], **kwargs) -> None:
         """
         Compute all Section 2.2 features using historical data.
         
+        The ATM row of every expiry is located once per minute and memoized in
+        the history; z-score windows are read from HistoryManager.rolling_stats
+        rather than re-stacked every minute. All change and z-score features
+        are then computed for every expiry at once by _atm_kernel.
+        
         Args:
             df: Input DataFrame for current minute
             history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer receiving one array per feature
             **kwargs: Additional context (filename, etc.)
-        
-        Returns:
-            DataFrame with Section 2.2 features added
         """
         logger.info("Computing Section 2.2 features (ATM node lookback)")
         
-        df_result = df.copy()
+        # Output matrix (rows x features, C order); each expiry's scalars are
+        # broadcast into its row positions. Features are rounded to 4 decimals,
+        # well within float32 precision, so the matrix is float32
+        computed_features = self._feature_names
+        matrix = np.full((len(df), len(computed_features)), np.nan, dtype=np.float32)
         
-        # Initialize all features with NaN
-        for feature in self.feature_names:
-            df_result[feature] = np.nan
+        # Lags and windows the history can serve, decided once; the rest stay NaN
+        history_size = history_mgr.get_current_size()
+        ready_lags = [lag for lag in self.LAGS if lag <= history_size]
+        ready_windows = [window for window in self.ZSCORE_WINDOWS if window <= history_size]
+        if len(ready_lags) < len(self.LAGS) or len(ready_windows) < len(self.ZSCORE_WINDOWS):
+            logger.debug(
+                f"History has {history_size} minutes: computing lags {ready_lags} "
+                f"and z-score windows {ready_windows}, others NaN"
+            )
         
-        # Group by expiry to compute ATM features per expiry
-        for expiry, expiry_group in df_result.groupby('expirDate'):
-            # Get ATM values for current minute
-            atm_values = self._get_atm_values(expiry_group)
+        if ready_lags or ready_windows:
+            # Expiry codes of the current rows, factorized once per minute;
+            # the ATM snapshot is kept for this minute's history entry, so it
+            # is not scanned again
+            factorized = history_mgr.get_current_derived(df, EXPIRY_CODES_KEY, expiry_codes)
+            codes, expiries = factorized
+            current_atm = history_mgr.get_current_derived(
+                df, self.ATM_CACHE_KEY, lambda minute_df: self._atm_snapshot(minute_df, factorized)
+            )
             
-            if atm_values is None:
-                logger.debug(f"Could not identify ATM row for expiry {expiry}")
-                continue
+            # Current ATM values as an (expiries, ATM_COLUMNS) matrix
+            current = self._atm_matrix(current_atm, expiries)
             
-            # Compute lag change features
-            df_result.loc[expiry_group.index, 'ATM_CallIVChange_L1'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallIVMid'], 'CallIVMid', lag=1
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallIVChange_L5'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallIVMid'], 'CallIVMid', lag=5
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallIVChange_L15'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallIVMid'], 'CallIVMid', lag=15
-            )
+            # ATM snapshots of the lag frames (queue[-lag]), memoized per minute in
+            # the history so each historical frame is scanned once over its lifetime
+            lag_values = np.full((len(self.LAGS),) + current.shape, np.nan)
+            for lag_idx, lag in enumerate(self.LAGS):
+                if lag in ready_lags:
+                    lag_atm = history_mgr.get_derived(lag, self.ATM_CACHE_KEY, self._atm_snapshot)
+                    lag_values[lag_idx] = self._atm_matrix(lag_atm, expiries)
             
-            # Compute z-score features
-            df_result.loc[expiry_group.index, 'ATM_CallIVZ_5'] = self._compute_atm_zscore(
-                history_mgr, expiry, atm_values['CallIVMid'], 'CallIVMid', window=5
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallIVZ_15'] = self._compute_atm_zscore(
-                history_mgr, expiry, atm_values['CallIVMid'], 'CallIVMid', window=15
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallIVZ_30'] = self._compute_atm_zscore(
-                history_mgr, expiry, atm_values['CallIVMid'], 'CallIVMid', window=30
-            )
+            # Window count, mean and variance of ATM CallIVMid per z-score
+            # window, (windows, expiries), from the history's running window
+            # sums of the ATM snapshots; windows the history cannot serve keep
+            # count 0
+            window_count = np.zeros((len(self.ZSCORE_WINDOWS), len(expiries)))
+            window_mean = np.full_like(window_count, np.nan)
+            window_var = np.full_like(window_count, np.nan)
+            for window_idx, window in enumerate(self.ZSCORE_WINDOWS):
+                if window in ready_windows:
+                    stats_expiries, count, mean, var = history_mgr.rolling_stats(
+                        window, self.ATM_CACHE_KEY, self._atm_snapshot, len(self.ATM_COLUMNS)
+                    )
+                    rows = stats_expiries.get_indexer(expiries)
+                    found = rows >= 0
+                    window_count[window_idx, found] = count[rows[found], 0]
+                    window_mean[window_idx, found] = mean[rows[found], 0]
+                    window_var[window_idx, found] = var[rows[found], 0]
             
-            # Compute spread change features
-            df_result.loc[expiry_group.index, 'ATM_CallSpreadPctChange_L1'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallSpreadPct'], 'CallSpreadPct', lag=1
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallSpreadPctChange_L5'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallSpreadPct'], 'CallSpreadPct', lag=5
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallSpreadPctChange_L15'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallSpreadPct'], 'CallSpreadPct', lag=15
-            )
+            # All expiries at once: (expiries, features) in feature_names order
+            expiry_features = self._atm_kernel(current, lag_values, window_count, window_mean, window_var)
             
-            # Compute gamma change features
-            df_result.loc[expiry_group.index, 'ATM_CallGammaChange_L1'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallGamma'], 'CallGamma', lag=1
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallGammaChange_L5'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallGamma'], 'CallGamma', lag=5
-            )
-            df_result.loc[expiry_group.index, 'ATM_CallGammaChange_L15'] = self._compute_atm_change(
-                history_mgr, expiry, atm_values['CallGamma'], 'CallGamma', lag=15
-            )
+            # Broadcast each expiry's row to its rows in df through the expiry codes
+            rows = np.flatnonzero(codes >= 0)
+            matrix[rows] = expiry_features[codes[rows]]
         
         # Round all computed features to 4 decimals
-        computed_features = self.feature_names
-        df_result[computed_features] = df_result[computed_features].round(4)
+        np.round(matrix, 4, out=matrix)
+        for col_idx, name in enumerate(computed_features):
+            out[name] = matrix[:, col_idx]
         
         logger.info(f"Section 2.2 features computed: {len(computed_features)} features")
-        
-        return df_result
     
-    def _get_atm_values(self, expiry_group: pd.DataFrame) -> Optional[Dict[str, float]]:
+    def _atm_matrix(self, atm: Optional[Tuple[pd.Index, np.ndarray]], expiries: pd.Index) -> np.ndarray:
         """
-        Identify ATM row and extract relevant values.
+        Project an ATM snapshot onto a fixed expiry order.
         
         Args:
-            expiry_group: DataFrame subset for a single expiry
+            atm: ATM snapshot (see _atm_snapshot), or None if unavailable
+            expiries: Expiry order of the output rows
         
         Returns:
-            Dictionary with ATM values or None if not found
-        """
-        try:
-            # Find row with minimum absolute distance_to_atm
-            min_distance = expiry_group['distance_to_atm'].abs().min()
-            atm_rows = expiry_group[expiry_group['distance_to_atm'].abs() == min_distance]
-            
-            # Take first row if multiple have same distance
-            atm_row = atm_rows.iloc[0]
-            
-            return {
-                'CallIVMid': atm_row.get('CallIVMid', np.nan),
-                'CallSpreadPct': atm_row.get('CallSpreadPct', np.nan),
-                'CallGamma': atm_row.get('CallGamma', np.nan)
-            }
-        except (KeyError, IndexError) as e:
-            logger.debug(f"Error extracting ATM values: {e}")
-            return None
-    
-    def _get_historical_atm_value(
-        self, 
-        hist_df: pd.DataFrame, 
-        expiry: str, 
-        column: str
-    ) -> Optional[float]:
+            (expiries, ATM_COLUMNS) float64 matrix, NaN for expiries missing from atm
         """
-        Extract ATM value for a specific expiry from historical DataFrame.
+        matrix = np.full((len(expiries), len(self.ATM_COLUMNS)), np.nan)
+        if atm is None or len(atm[0]) == 0:
+            return matrix
         
-        Args:
-            hist_df: Historical DataFrame
-            expiry: Expiry date to filter
-            column: Column name to extract
-        
-        Returns:
-            ATM value or None if not found
-        """
-        try:
-            # Filter for the specific expiry
-            expiry_data = hist_df[hist_df['expirDate'] == expiry]
-            
-            if expiry_data.empty:
-                return None
-            
-            # Find ATM row
-            min_distance = expiry_data['distance_to_atm'].abs().min()
-            atm_rows = expiry_data[expiry_data['distance_to_atm'].abs() == min_distance]
-            
-            if atm_rows.empty:
-                return None
-            
-            # Take first row if multiple
-            atm_value = atm_rows.iloc[0].get(column, np.nan)
-            
-            return atm_value if not pd.isna(atm_value) else None
-        except (KeyError, IndexError) as e:
-            logger.debug(f"Error extracting historical ATM value: {e}")
-            return None
+        snapshot_expiries, values = atm
+        rows = snapshot_expiries.get_indexer(expiries)
+        found = rows >= 0
+        matrix[found] = values[rows[found]]
+        return matrix
     
-    def _compute_atm_change(
+    def _atm_kernel(
         self,
-        history_mgr: 'HistoryManager',
-        expiry: str,
-        current_value: float,
-        column: str,
-        lag: int
-    ) -> float:
+        current: np.ndarray,
+        lag_values: np.ndarray,
+        window_count: np.ndarray,
+        window_mean: np.ndarray,
+        window_var: np.ndarray
+    ) -> np.ndarray:
         """
-        Compute change in ATM value over lag k: value_t - value_{t-k}.
+        Compute every ATM change and z-score feature for all expiries in one pass.
         
         Args:
-            history_mgr: HistoryManager instance
-            expiry: Expiry date
-            current_value: Current ATM value
-            column: Column name to extract from history
-            lag: Number of minutes to look back
+            current: Current ATM values, (expiries, ATM_COLUMNS)
+            lag_values: ATM values per lag in LAGS order, (lags, expiries, ATM_COLUMNS)
+            window_count: Valid history CallIVMid values per z-score window in
+                ZSCORE_WINDOWS order, (windows, expiries); 0 for windows the
+                history does not cover
+            window_mean: History CallIVMid means, (windows, expiries)
+            window_var: History CallIVMid sample variances, (windows, expiries)
         
         Returns:
-            Change value or NaN if insufficient history
+            (expiries, features) matrix; NaN where the current ATM row or the
+            required history is missing
         """
-        # Check if we have enough history
-        if history_mgr.get_current_size() < lag:
-            logger.debug(f"Insufficient history for lag {lag}, returning NaN")
-            return np.nan
+        n_expiries = current.shape[0]
+        result = np.full((n_expiries, len(self._feature_names)), np.nan)
         
-        # Check if current value is valid
-        if pd.isna(current_value):
-            return np.nan
+        # Lag change features: value_t - value_{t-k}, scattered through the
+        # (lag, column) dispatch table
+        changes = current[np.newaxis] - lag_values
+        result[:, self._change_dispatch.ravel()] = changes.transpose(1, 0, 2).reshape(n_expiries, -1)
         
-        try:
-            # Get historical DataFrame
-            # For lag=1, we want the most recent in history (queue[-1])
-            # For lag=5, we want 5 minutes ago (queue[-5])
-            if lag > len(history_mgr.queue):
-                logger.debug(f"Insufficient history for lag {lag}, returning NaN")
-                return np.nan
-            
-            index = -lag
-            hist_df = list(history_mgr.queue)[index][3]
-            
-            if hist_df is None or hist_df.empty:
-                logger.debug(f"Empty history for lag {lag}, returning NaN")
-                return np.nan
-            
-            # Extract historical ATM value for this expiry
-            historical_value = self._get_historical_atm_value(hist_df, expiry, column)
-            
-            if historical_value is None:
-                logger.debug(f"Could not find historical ATM value for expiry {expiry}, lag {lag}")
-                return np.nan
-            
-            # Compute change
-            return current_value - historical_value
-        except (KeyError, IndexError) as e:
-            logger.debug(f"Error computing ATM change for lag {lag}: {e}")
-            return np.nan
+        # Z-score features of CallIVMid: sample std over the valid window
+        # values plus the current value, for every window at once
+        zscores = merged_zscore(current[:, 0], window_count, window_mean, window_var)
+        result[:, self._zscore_dispatch] = zscores.T
+        
+        return result
     
-    def _compute_atm_zscore(
-        self,
-        history_mgr: 'HistoryManager',
-        expiry: str,
-        current_value: float,
-        column: str,
-        window: int
-    ) -> float:
+    def _atm_snapshot(
+        self, df: pd.DataFrame, expiries: Optional[Tuple[np.ndarray, pd.Index]] = None
+    ) -> Tuple[pd.Index, np.ndarray]:
         """
-        Compute z-score of ATM value over window N: (value - mean) / std.
+        Locate the ATM row of every expiry in a minute frame.
+        
+        The ATM row is the first row (in frame order) with minimum absolute
+        distance_to_atm. All expiries are resolved together: one stable sort
+        by (expiry, |distance|) puts each expiry's ATM row first in its run.
+        Missing value columns read as NaN. The result is a column-oriented
+        snapshot, so lookups against history never touch the minute's
+        DataFrame again.
         
         Args:
-            history_mgr: HistoryManager instance
-            expiry: Expiry date
-            current_value: Current ATM value
-            column: Column name to extract from history
-            window: Window size in minutes
+            df: Minute DataFrame
+            expiries: Expiry factorization of df, if already computed (see
+                expiry_codes)
         
         Returns:
-            Z-score or NaN if insufficient history
+            Tuple of (expiries, values): an Index of expiries and the matching
+            (expiries, ATM_COLUMNS) float64 array; expiries without a valid
+            distance_to_atm are omitted
         """
-        window_dfs = history_mgr.get_window(window)
+        empty = (pd.Index([]), np.empty((0, len(self.ATM_COLUMNS))))
+        if df is None or df.empty:
+            return empty
         
-        if len(window_dfs) < window:
-            logger.debug(f"Insufficient history for z-score window {window}, returning NaN")
-            return np.nan
+        try:
+            distance = np.abs(df['distance_to_atm'].to_numpy(dtype=np.float64))
+            codes, uniques = expiry_codes(df) if expiries is None else expiries
+        except (KeyError, ValueError, TypeError) as e:
+            logger.debug(f"Error extracting ATM values: {e}")
+            return empty
         
-        # Check if current value is valid
-        if pd.isna(current_value):
-            return np.nan
+        values = np.column_stack([
+            df[col].to_numpy(dtype=np.float64) if col in df.columns else np.full(len(df), np.nan)
+            for col in self.ATM_COLUMNS
+        ])
         
-        try:
-            # Extract ATM values from window
-            values = []
-            for hist_df in window_dfs:
-                hist_value = self._get_historical_atm_value(hist_df, expiry, column)
-                if hist_value is not None:
-                    values.append(hist_value)
-            
-            # Add current value
-            values.append(current_value)
-            
-            if len(values) < 2:
-                logger.debug(f"Insufficient valid values for z-score window {window}")
-                return np.nan
-            
-            # Compute z-score
-            mean = np.mean(values)
-            std = np.std(values, ddof=1)  # Use sample std
-            
-            # Avoid division by zero
-            if std < 1e-6:
-                logger.debug(f"Standard deviation too small for z-score calculation")
-                return np.nan
-            
-            return (current_value - mean) / std
-        except (KeyError, IndexError) as e:
-            logger.debug(f"Error computing ATM z-score for window {window}: {e}")
-            return np.nan
+        # Stable sort by expiry code, then |distance| (NaN last); the first row
+        # of each expiry run is its ATM row
+        order = np.lexsort((distance, codes))
+        sorted_codes = codes[order]
+        run_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        atm_rows = order[run_starts]
+        
+        # Drop rows without an expiry (code -1) and expiries with no valid distance
+        atm_rows = atm_rows[(codes[atm_rows] >= 0) & ~np.isnan(distance[atm_rows])]
+        
+        return uniques.take(codes[atm_rows]), values[atm_rows]
@@ -3,7 +3,8 @@
 import logging
 import pandas as pd
 import numpy as np
-from typing import TYPE_CHECKING, Optional, List
+from typing import TYPE_CHECKING, Dict, Optional, List, Tuple
+from .contract_keys import EXPIRY_CODES_KEY, INVALID_KEY, contract_keys, expiry_codes
 from .registry import FeatureSection
 
 if TYPE_CHECKING:
@@ -12,9 +13,42 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+def _zscore_kernel(current: np.ndarray, mean: np.ndarray, var: np.ndarray) -> np.ndarray:
+    """
+    Compute z-scores of current values against window statistics.
+    
+    Args:
+        current: Current values
+        mean: Window means, same shape as current
+        var: Window sample variances (ddof=1), NaN where fewer than two
+            history values are valid
+    
+    Returns:
+        Z-scores; NaN where var is NaN or the std is at most 1e-6
+    """
+    std = np.sqrt(var)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscore = (current - mean) / std
+    return np.where(std > 1e-6, zscore, np.nan)
+
+
 class SectionContractFeatures(FeatureSection):
     """Implements Section 5 features (Per-contract short history)."""
     
+    # Columns kept per contract in history snapshots, in snapshot column order
+    CONTRACT_COLUMNS = ('CallMid', 'CallIVMid', 'CallSpreadPct', 'callVolume',
+                        'PutMid', 'PutIVMid', 'PutSpreadPct', 'putVolume')
+    # Columns whose log is appended to the snapshot columns (NaN unless
+    # positive), so log returns are a subtraction of cached logs
+    LOG_COLUMNS = ('CallMid', 'PutMid')
+    LEGS = ('Call', 'Put')
+    RETURN_LAGS = (1, 2, 3)
+    CHANGE_LAGS = (1,)
+    ZSCORE_WINDOWS = (3, 5)
+    
+    # HistoryManager derived-value key for per-minute contract snapshots
+    CONTRACT_CACHE_KEY = 'contract_snapshot'
+    
     @property
     def feature_names(self) -> list:
         """Return list of feature names in this section."""
@@ -45,202 +79,202 @@ class SectionContractFeatures(FeatureSection):
             'PutSpreadPctChange_L1'
         ]
     
-    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager', **kwargs) -> pd.DataFrame:
+    def __init__(self):
+        """Build the feature name -> output column and snapshot column maps once."""
+        self._feature_names = self.feature_names
+        self._col = {name: i for i, name in enumerate(self._feature_names)}
+        value_col = {name: i for i, name in enumerate(self.CONTRACT_COLUMNS)}
+        log_col = {name: len(self.CONTRACT_COLUMNS) + i for i, name in enumerate(self.LOG_COLUMNS)}
+        self._n_values = len(self.CONTRACT_COLUMNS) + len(self.LOG_COLUMNS)
+        self._log_sources = np.array([value_col[name] for name in self.LOG_COLUMNS], dtype=np.intp)
+        
+        # Snapshot columns read by each feature kind, with the output column
+        # of each (lag or window, source column) pair
+        self._return_sources = np.array([log_col[f'{leg}Mid'] for leg in self.LEGS], dtype=np.intp)
+        self._return_dispatch = {
+            lag: np.array([self._col[f'{leg}MidReturn_L{lag}'] for leg in self.LEGS], dtype=np.intp)
+            for lag in self.RETURN_LAGS
+        }
+        self._change_sources = np.array(
+            [value_col[f'{leg}{col}'] for leg in self.LEGS for col in ('IVMid', 'SpreadPct')], dtype=np.intp
+        )
+        self._change_dispatch = {
+            lag: np.array(
+                [self._col[f'{leg}{name}Change_L{lag}'] for leg in self.LEGS for name in ('IV', 'SpreadPct')],
+                dtype=np.intp
+            )
+            for lag in self.CHANGE_LAGS
+        }
+        self._zscore_sources = np.array(
+            [value_col[col] for leg in self.LEGS for col in (f'{leg}Mid', f'{leg}IVMid', f'{leg.lower()}Volume')],
+            dtype=np.intp
+        )
+        self._zscore_dispatch = {
+            window: np.array(
+                [self._col[f'{leg}{name}Z_{window}'] for leg in self.LEGS for name in ('Mid', 'IV', 'Volume')],
+                dtype=np.intp
+            )
+            for window in self.ZSCORE_WINDOWS
+        }
+    
+    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                out: Dict[str, np.ndarray], **kwargs) -> None:
         """
         Compute all Section 5 features using historical data.
         
+        Each history minute is reduced once to a contract snapshot (see
+        _contract_snapshot), memoized in the history. Lag frames are aligned
+        to the current contracts as (rows, snapshot columns) matrices; window
+        mean and variance come from HistoryManager.rolling_stats, which keeps
+        running sums instead of re-reducing the window every minute. The
+        module-level kernels compute every leg of a lag or window in one call.
+        
         Args:
             df: Input DataFrame for current minute
             history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer receiving one array per feature
             **kwargs: Additional context (filename, etc.)
-        
-        Returns:
-            DataFrame with Section 5 features added
         """
         logger.info("Computing Section 5 features (Per-contract short history)")
         
-        df_result = df.copy()
-        
-        # Initialize all features with NaN
-        for feature in self.feature_names:
-            df_result[feature] = np.nan
+        # Output matrix (rows x features), initialized with NaN
+        features = np.full((len(df), len(self._col)), np.nan)
         
-        # Build historical lookups for vectorized operations
-        hist_lag_1 = self._build_lag_lookup(history_mgr, lag=1)
-        hist_lag_2 = self._build_lag_lookup(history_mgr, lag=2)
-        hist_lag_3 = self._build_lag_lookup(history_mgr, lag=3)
-        hist_window_3 = self._build_window_data(history_mgr, window=3)
-        hist_window_5 = self._build_window_data(history_mgr, window=5)
+        # Lags and windows the history can serve, decided once; the rest stay NaN
+        history_size = history_mgr.get_current_size()
+        ready_lags = [lag for lag in sorted(set(self.RETURN_LAGS) | set(self.CHANGE_LAGS)) if lag <= history_size]
+        ready_windows = [window for window in self.ZSCORE_WINDOWS if window <= history_size]
         
-        # Vectorized Call features
-        if hist_lag_1 is not None:
-            df_result = self._compute_log_returns_vectorized(df_result, hist_lag_1, 'Call', lag=1)
-            df_result = self._compute_log_returns_vectorized(df_result, hist_lag_1, 'Put', lag=1)
-            df_result = self._compute_changes_vectorized(df_result, hist_lag_1, 'Call', lag=1)
-            df_result = self._compute_changes_vectorized(df_result, hist_lag_1, 'Put', lag=1)
-        
-        if hist_lag_2 is not None:
-            df_result = self._compute_log_returns_vectorized(df_result, hist_lag_2, 'Call', lag=2)
-            df_result = self._compute_log_returns_vectorized(df_result, hist_lag_2, 'Put', lag=2)
-        
-        if hist_lag_3 is not None:
-            df_result = self._compute_log_returns_vectorized(df_result, hist_lag_3, 'Call', lag=3)
-            df_result = self._compute_log_returns_vectorized(df_result, hist_lag_3, 'Put', lag=3)
-        
-        if hist_window_3 is not None:
-            df_result = self._compute_zscores_vectorized(df_result, hist_window_3, 'Call', window=3)
-            df_result = self._compute_zscores_vectorized(df_result, hist_window_3, 'Put', window=3)
-        
-        if hist_window_5 is not None:
-            df_result = self._compute_zscores_vectorized(df_result, hist_window_5, 'Call', window=5)
-            df_result = self._compute_zscores_vectorized(df_result, hist_window_5, 'Put', window=5)
+        if not ready_lags and not ready_windows:
+            # Nothing to look back on (first minute of a run): skip building
+            # keys and values, every feature stays NaN
+            logger.debug(f"History has {history_size} minutes: all Section 5 features NaN")
+        else:
+            # Contract keys and values of the current rows, built once and shared
+            # by every lag and window alignment
+            expiries = history_mgr.get_current_derived(df, EXPIRY_CODES_KEY, expiry_codes)
+            keys = pd.Index(contract_keys(df, expiries))
+            current = self._value_matrix(df)
+            
+            # The keyed snapshot is built from these arrays and kept for this
+            # minute's history entry, so the minute is not reduced again when
+            # it becomes a lag
+            history_mgr.get_current_derived(
+                df, self.CONTRACT_CACHE_KEY,
+                lambda minute_df: self._contract_snapshot(minute_df, keys.to_numpy(), current)
+            )
+            
+            # Lag features
+            for lag in ready_lags:
+                snapshot = history_mgr.get_derived(lag, self.CONTRACT_CACHE_KEY, self._contract_snapshot)
+                hist = self._align_snapshot(snapshot, keys)
+                
+                if lag in self.RETURN_LAGS:
+                    # log(current / hist) as a difference of cached logs; NaN
+                    # unless both mids are positive
+                    features[:, self._return_dispatch[lag]] = (
+                        current[:, self._return_sources] - hist[:, self._return_sources]
+                    )
+                if lag in self.CHANGE_LAGS:
+                    features[:, self._change_dispatch[lag]] = (
+                        current[:, self._change_sources] - hist[:, self._change_sources]
+                    )
+            
+            # Window z-score features from the history's running window sums of
+            # the contract snapshots (the current value is not part of the window)
+            for window in ready_windows:
+                stats_keys, _, mean, var = history_mgr.rolling_stats(
+                    window, self.CONTRACT_CACHE_KEY, self._contract_snapshot, self._n_values
+                )
+                rows = stats_keys.get_indexer(keys)
+                found = rows >= 0
+                window_mean = np.full((len(keys), len(self._zscore_sources)), np.nan)
+                window_var = np.full_like(window_mean, np.nan)
+                window_mean[found] = mean[rows[found]][:, self._zscore_sources]
+                window_var[found] = var[rows[found]][:, self._zscore_sources]
+                features[:, self._zscore_dispatch[window]] = _zscore_kernel(
+                    current[:, self._zscore_sources], window_mean, window_var
+                )
         
         # Round all computed features to 4 decimals
-        computed_features = self.feature_names
-        df_result[computed_features] = df_result[computed_features].round(4)
+        computed_features = self._feature_names
+        np.round(features, 4, out=features)
+        for col_idx, feature in enumerate(computed_features):
+            out[feature] = features[:, col_idx]
         
         logger.info(f"Section 5 features computed: {len(computed_features)} features")
-        
-        return df_result
     
-    def _build_lag_lookup(self, history_mgr: 'HistoryManager', lag: int) -> Optional[pd.DataFrame]:
-        """Build historical lookup DataFrame for a specific lag."""
-        if history_mgr.get_current_size() < lag:
-            return None
+    def _value_matrix(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Extract the snapshot columns as a (rows, columns) float64 matrix.
         
-        try:
-            index = -lag
-            hist_df = list(history_mgr.queue)[index][3]
-            
-            if hist_df is None or hist_df.empty:
-                return None
-            
-            # Return relevant columns
-            cols = ['expirDate', 'strike', 'CallMid', 'CallIVMid', 'CallSpreadPct', 'callVolume',
-                   'PutMid', 'PutIVMid', 'PutSpreadPct', 'putVolume']
-            return hist_df[cols].copy()
-        except (KeyError, IndexError):
-            return None
-    
-    def _build_window_data(self, history_mgr: 'HistoryManager', window: int) -> Optional[pd.DataFrame]:
-        """Build concatenated historical data for a window."""
-        window_dfs = history_mgr.get_window(window)
+        Args:
+            df: Minute DataFrame
         
-        if len(window_dfs) < window:
-            return None
+        Returns:
+            Value matrix: CONTRACT_COLUMNS followed by the logs of
+            LOG_COLUMNS; missing columns and non-positive log inputs read as NaN
+        """
+        values = np.full((len(df), self._n_values), np.nan)
+        for col_idx, col in enumerate(self.CONTRACT_COLUMNS):
+            if col in df.columns:
+                values[:, col_idx] = df[col].to_numpy(dtype=np.float64)
         
-        try:
-            cols = ['expirDate', 'strike', 'CallMid', 'CallIVMid', 'callVolume',
-                   'PutMid', 'PutIVMid', 'putVolume']
-            dfs_to_concat = [df[cols].copy() for df in window_dfs if df is not None and not df.empty]
-            
-            if not dfs_to_concat:
-                return None
-            
-            return pd.concat(dfs_to_concat, ignore_index=True)
-        except (KeyError, IndexError):
-            return None
+        log_inputs = values[:, self._log_sources]
+        np.log(log_inputs, out=values[:, len(self.CONTRACT_COLUMNS):], where=log_inputs > 0)
+        return values
     
-    def _compute_log_returns_vectorized(
-        self, 
-        df: pd.DataFrame, 
-        hist_df: pd.DataFrame, 
-        leg: str,
-        lag: int
-    ) -> pd.DataFrame:
-        """Vectorized log return computation."""
-        col = f'{leg}Mid'
-        
-        # Merge to get historical values
-        merged = df.merge(
-            hist_df[['expirDate', 'strike', col]],
-            on=['expirDate', 'strike'],
-            how='left',
-            suffixes=('', '_hist')
-        )
+    def _contract_snapshot(self, df: pd.DataFrame, keys: Optional[np.ndarray] = None,
+                           values: Optional[np.ndarray] = None) -> Optional[Tuple[pd.Index, np.ndarray]]:
+        """
+        Reduce a history minute to its contract keys and values.
         
-        # Compute log returns vectorized
-        current = merged[col]
-        historical = merged[f'{col}_hist']
+        Args:
+            df: Minute DataFrame
+            keys: Contract keys of df rows, if already computed (see contract_keys)
+            values: Value matrix of df rows, if already computed (see _value_matrix)
         
-        # Only compute where both values are positive
-        mask = (current > 0) & (historical > 0)
-        df[f'{leg}MidReturn_L{lag}'] = np.where(mask, np.log(current / historical), np.nan)
+        Returns:
+            Tuple of (int64 contract key index (see contract_keys),
+            (contracts, snapshot columns) float64 matrix), first row per
+            contract, rows without a valid key dropped; None if df is empty
+            or has no contract keys
+        """
+        if df is None or df.empty:
+            return None
         
-        return df
-    
-    def _compute_changes_vectorized(
-        self,
-        df: pd.DataFrame,
-        hist_df: pd.DataFrame,
-        leg: str,
-        lag: int
-    ) -> pd.DataFrame:
-        """Vectorized change computation."""
-        # IV change
-        iv_col = f'{leg}IVMid'
-        merged_iv = df.merge(
-            hist_df[['expirDate', 'strike', iv_col]],
-            on=['expirDate', 'strike'],
-            how='left',
-            suffixes=('', '_hist')
-        )
-        df[f'{leg}IVChange_L{lag}'] = merged_iv[iv_col] - merged_iv[f'{iv_col}_hist']
-        
-        # Spread change
-        spread_col = f'{leg}SpreadPct'
-        merged_spread = df.merge(
-            hist_df[['expirDate', 'strike', spread_col]],
-            on=['expirDate', 'strike'],
-            how='left',
-            suffixes=('', '_hist')
-        )
-        df[f'{leg}SpreadPctChange_L{lag}'] = merged_spread[spread_col] - merged_spread[f'{spread_col}_hist']
+        if keys is None:
+            try:
+                keys = contract_keys(df)
+            except KeyError:
+                return None
+        if values is None:
+            values = self._value_matrix(df)
         
-        return df
+        keep = (keys != INVALID_KEY) & ~pd.Index(keys).duplicated()
+        if not keep.all():
+            keys, values = keys[keep], values[keep]
+        return pd.Index(keys), values
     
-    def _compute_zscores_vectorized(
-        self,
-        df: pd.DataFrame,
-        hist_window: pd.DataFrame,
-        leg: str,
-        window: int
-    ) -> pd.DataFrame:
-        """Vectorized z-score computation."""
-        # Compute stats for each contract
-        mid_col = f'{leg}Mid'
-        iv_col = f'{leg}IVMid'
-        vol_col = f'{leg.lower()}Volume'
-        
-        # Group by contract and compute mean/std
-        stats_mid = hist_window.groupby(['expirDate', 'strike'])[mid_col].agg(['mean', 'std']).reset_index()
-        stats_iv = hist_window.groupby(['expirDate', 'strike'])[iv_col].agg(['mean', 'std']).reset_index()
-        stats_vol = hist_window.groupby(['expirDate', 'strike'])[vol_col].agg(['mean', 'std']).reset_index()
-        
-        # Merge stats back to current data
-        df_with_stats_mid = df.merge(stats_mid, on=['expirDate', 'strike'], how='left', suffixes=('', '_stats'))
-        df_with_stats_iv = df.merge(stats_iv, on=['expirDate', 'strike'], how='left', suffixes=('', '_stats'))
-        df_with_stats_vol = df.merge(stats_vol, on=['expirDate', 'strike'], how='left', suffixes=('', '_stats'))
-        
-        # Compute z-scores vectorized
-        df[f'{leg}MidZ_{window}'] = np.where(
-            df_with_stats_mid['std'] > 1e-6,
-            (df[mid_col] - df_with_stats_mid['mean']) / df_with_stats_mid['std'],
-            np.nan
-        )
+    def _align_snapshot(self, snapshot: Optional[Tuple[pd.Index, np.ndarray]],
+                        keys: pd.Index) -> np.ndarray:
+        """
+        Align a contract snapshot to the current contract keys.
         
-        df[f'{leg}IVZ_{window}'] = np.where(
-            df_with_stats_iv['std'] > 1e-6,
-            (df[iv_col] - df_with_stats_iv['mean']) / df_with_stats_iv['std'],
-            np.nan
-        )
+        Args:
+            snapshot: Contract snapshot (see _contract_snapshot), or None
+            keys: Current contract keys (see contract_keys)
         
-        df[f'{leg}VolumeZ_{window}'] = np.where(
-            df_with_stats_vol['std'] > 1e-6,
-            (df[vol_col] - df_with_stats_vol['mean']) / df_with_stats_vol['std'],
-            np.nan
-        )
+        Returns:
+            (len(keys), snapshot columns) matrix; row i holds the snapshot
+            values of contract keys[i], NaN where the contract is missing
+        """
+        aligned = np.full((len(keys), self._n_values), np.nan)
+        if snapshot is None:
+            return aligned
         
-        return df
-    
-
+        snapshot_keys, values = snapshot
+        rows = snapshot_keys.get_indexer(keys)
+        found = rows >= 0
+        aligned[found] = values[rows[found]]
+        return aligned
@@ -3,7 +3,8 @@
 import logging
 import pandas as pd
 import numpy as np
-from typing import TYPE_CHECKING, Optional, List
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from .contract_keys import EXPIRY_CODES_KEY, INVALID_KEY, contract_keys, expiry_codes
 from .registry import FeatureSection
 
 if TYPE_CHECKING:
@@ -15,6 +16,16 @@ logger = logging.getLogger(__name__)
 class SectionCrossSectionalFeatures(FeatureSection):
     """Implements Section 4 features (Cross-sectional dynamics)."""
     
+    # Percentile columns compared against lag frames, in snapshot column order
+    PERCENTILE_COLUMNS = ('IVPercentile_Expiry', 'VolumePercentile_Expiry', 'OIPercentile_Expiry')
+    PERCENTILE_LAGS = (5, 15)
+    VOLUME_SHARE_WINDOWS = (15, 30)
+    
+    # HistoryManager derived-value keys for per-minute percentile and volume
+    # share snapshots
+    PERCENTILE_CACHE_KEY = 'percentile_snapshot'
+    VOLUME_SHARE_CACHE_KEY = 'volume_share'
+    
     @property
     def feature_names(self) -> list:
         """Return list of feature names in this section."""
@@ -32,194 +43,278 @@ class SectionCrossSectionalFeatures(FeatureSection):
             'VolumeShare_ExpirySMA_30'
         ]
     
-    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager', **kwargs) -> pd.DataFrame:
+    def __init__(self):
+        """Build the feature name -> output column map once."""
+        self._feature_names = self.feature_names
+        self._col = {name: i for i, name in enumerate(self._feature_names)}
+        
+        # Output columns of the percentile changes per lag, in PERCENTILE_COLUMNS order
+        self._percentile_dispatch = {
+            lag: np.array([self._col[f'{col.split("_")[0]}_Change_L{lag}'] for col in self.PERCENTILE_COLUMNS],
+                          dtype=np.intp)
+            for lag in self.PERCENTILE_LAGS
+        }
+    
+    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                out: Dict[str, np.ndarray], **kwargs) -> None:
         """
         Compute all Section 4 features using historical data.
         
+        Features are computed in float64 and published as float32: volume
+        shares lie in [0, 1] and percentile changes are bounded by the
+        percentile range, so 4 decimals are well within float32 precision.
+        
         Args:
             df: Input DataFrame for current minute
             history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer receiving one array per feature
             **kwargs: Additional context (filename, etc.)
-        
-        Returns:
-            DataFrame with Section 4 features added
         """
         logger.info("Computing Section 4 features (Cross-sectional dynamics)")
         
-        df_result = df.copy()
+        # Output matrix (rows x features), initialized with NaN
+        features = np.full((len(df), len(self._col)), np.nan)
         
-        # Initialize all features with NaN
-        for feature in self.feature_names:
-            df_result[feature] = np.nan
+        # Expiry codes and contract keys of the current rows, shared by every
+        # historical lookup
+        expiries = history_mgr.get_current_derived(df, EXPIRY_CODES_KEY, expiry_codes)
+        keys = pd.Index(contract_keys(df, expiries))
         
-        # Compute volume share features first (current minute only)
-        df_result = self._compute_volume_share(df_result)
+        # Compute volume share features first (current minute only); the
+        # per-contract snapshot is kept for this minute's history entry
+        share = self._compute_volume_share(df, expiries)
+        features[:, self._col['VolumeShare_Expiry']] = share
+        current_share = history_mgr.get_current_derived(
+            df, self.VOLUME_SHARE_CACHE_KEY,
+            lambda minute_df: self._volume_share_snapshot(minute_df, keys.to_numpy(), share)
+        )
         
         # Build historical lookup indices for vectorized operations
         # This ensures we only look at historical data (no look-ahead)
-        hist_lookup_l5 = self._build_historical_lookup(history_mgr, lag=5)
-        hist_lookup_l15 = self._build_historical_lookup(history_mgr, lag=15)
-        hist_window_15 = self._build_window_lookup(history_mgr, window=15)
-        hist_window_30 = self._build_window_lookup(history_mgr, window=30)
-        
-        # Vectorized percentile change features (lag 5)
-        if hist_lookup_l5 is not None:
-            df_result = self._compute_percentile_changes_vectorized(
-                df_result, hist_lookup_l5, lag=5
-            )
+        hist_lookups = {lag: self._build_historical_lookup(history_mgr, lag=lag) for lag in self.PERCENTILE_LAGS}
         
-        # Vectorized percentile change features (lag 15)
-        if hist_lookup_l15 is not None:
-            df_result = self._compute_percentile_changes_vectorized(
-                df_result, hist_lookup_l15, lag=15
+        # Vectorized percentile change features (lags 5, 15); the current
+        # percentile matrix is extracted once and shared by both lags
+        ready_lookups = {lag: lookup for lag, lookup in hist_lookups.items() if lookup is not None}
+        if ready_lookups:
+            current_percentiles = np.column_stack([
+                df[col].to_numpy(dtype=np.float64) for col in self.PERCENTILE_COLUMNS
+            ])
+            # Kept for this minute's history entry, so the minute is not
+            # reduced again when it becomes a lag
+            history_mgr.get_current_derived(
+                df, self.PERCENTILE_CACHE_KEY,
+                lambda minute_df: self._percentile_snapshot(minute_df, keys.to_numpy(), current_percentiles)
             )
+            for lag, lookup in ready_lookups.items():
+                features = self._compute_percentile_changes_vectorized(
+                    current_percentiles, keys, features, lookup, lag=lag
+                )
         
-        # Vectorized volume share SMA features
-        if hist_window_15 is not None:
-            df_result['VolumeShare_ExpirySMA_15'] = self._compute_volume_share_sma_vectorized(
-                df_result, hist_window_15, window=15
-            )
-        
-        if hist_window_30 is not None:
-            df_result['VolumeShare_ExpirySMA_30'] = self._compute_volume_share_sma_vectorized(
-                df_result, hist_window_30, window=30
-            )
+        # Volume share SMA features from the history's running window sums
+        history_size = history_mgr.get_current_size()
+        for window in self.VOLUME_SHARE_WINDOWS:
+            if window <= history_size:
+                features[:, self._col[f'VolumeShare_ExpirySMA_{window}']] = self._compute_volume_share_sma(
+                    history_mgr, current_share, keys, window
+                )
         
-        # Round all computed features to 4 decimals
-        computed_features = self.feature_names
-        df_result[computed_features] = df_result[computed_features].round(4)
+        # Round all computed features to 4 decimals, then narrow once to float32
+        computed_features = self._feature_names
+        np.round(features, 4, out=features)
+        features = features.astype(np.float32)
+        for col_idx, feature in enumerate(computed_features):
+            out[feature] = features[:, col_idx]
         
         logger.info(f"Section 4 features computed: {len(computed_features)} features")
-        
-        return df_result
     
-    def _build_historical_lookup(self, history_mgr: 'HistoryManager', lag: int) -> Optional[pd.DataFrame]:
+    def _build_historical_lookup(
+        self, history_mgr: 'HistoryManager', lag: int
+    ) -> Optional[Tuple[pd.Index, np.ndarray]]:
         """
-        Build historical lookup DataFrame for a specific lag.
+        Build the historical percentile snapshot for a specific lag.
         Returns None if insufficient history.
         """
         if history_mgr.get_current_size() < lag:
             return None
         
-        try:
-            index = -lag
-            hist_df = list(history_mgr.queue)[index][3]
-            
-            if hist_df is None or hist_df.empty:
-                return None
-            
-            # Return only the columns we need with (expirDate, strike) as index
-            return hist_df[['expirDate', 'strike', 'IVPercentile_Expiry', 
-                           'VolumePercentile_Expiry', 'OIPercentile_Expiry']].copy()
-        except (KeyError, IndexError):
-            return None
+        return history_mgr.get_derived(lag, self.PERCENTILE_CACHE_KEY, self._percentile_snapshot)
     
-    def _build_window_lookup(self, history_mgr: 'HistoryManager', window: int) -> Optional[List[pd.DataFrame]]:
+    def _percentile_snapshot(self, df: pd.DataFrame, keys: Optional[np.ndarray] = None,
+                             values: Optional[np.ndarray] = None) -> Optional[Tuple[pd.Index, np.ndarray]]:
         """
-        Build list of historical DataFrames for a window.
-        Returns None if insufficient history.
+        Reduce a history minute to its contract keys and percentile values.
+        
+        Args:
+            df: Minute DataFrame
+            keys: Contract keys of df rows, if already computed (see contract_keys)
+            values: (rows, PERCENTILE_COLUMNS) values of df, if already extracted
+        
+        Returns:
+            Tuple of (int64 contract key index (see contract_keys),
+            (contracts, PERCENTILE_COLUMNS) float32 matrix), first row per
+            contract, rows without a valid key dropped; None if df is empty or
+            lacks the columns. Percentiles are bounded and the changes are
+            published as float32, so the history copy is kept at half width
         """
-        window_dfs = history_mgr.get_window(window)
+        if df is None or df.empty:
+            return None
         
-        if len(window_dfs) < window:
+        try:
+            if keys is None:
+                keys = contract_keys(df)
+            if values is None:
+                values = np.column_stack([df[col].to_numpy() for col in self.PERCENTILE_COLUMNS])
+        except KeyError:
             return None
         
-        # Pre-compute volume share for each historical DataFrame
-        result = []
-        for hist_df in window_dfs:
-            if hist_df is not None and not hist_df.empty:
-                hist_with_share = self._compute_volume_share(hist_df)
-                result.append(hist_with_share[['expirDate', 'strike', 'VolumeShare_Expiry']].copy())
+        values = values.astype(np.float32)
         
-        return result if result else None
+        keep = (keys != INVALID_KEY) & ~pd.Index(keys).duplicated()
+        if not keep.all():
+            keys, values = keys[keep], values[keep]
+        return pd.Index(keys), values
     
     def _compute_percentile_changes_vectorized(
-        self, 
-        df: pd.DataFrame, 
-        hist_df: pd.DataFrame, 
+        self,
+        current: np.ndarray,
+        keys: pd.Index,
+        features: np.ndarray,
+        hist_snapshot: Tuple[pd.Index, np.ndarray],
         lag: int
-    ) -> pd.DataFrame:
+    ) -> np.ndarray:
         """
-        Vectorized computation of percentile changes using merge.
+        Vectorized computation of percentile changes using a positional gather.
+        
+        Reads the current (rows, PERCENTILE_COLUMNS) values and writes the
+        changes into the features matrix. The snapshot keys are unique, so one get_indexer gives each
+        current row's position in the snapshot values (-1 if absent).
         """
-        # Create merge key
-        df_with_key = df.copy()
-        hist_with_key = hist_df.copy()
-        
-        # Merge on (expirDate, strike) to get historical values
-        merged = df_with_key.merge(
-            hist_with_key,
-            on=['expirDate', 'strike'],
-            how='left',
-            suffixes=('', '_hist')
-        )
+        hist_keys, hist_values = hist_snapshot
+        positions = hist_keys.get_indexer(keys)
+        found = positions >= 0
+        hist_aligned = np.full((len(keys), len(self.PERCENTILE_COLUMNS)), np.nan)
+        hist_aligned[found] = hist_values[positions[found]]
         
-        # Compute changes vectorized
-        df[f'IVPercentile_Change_L{lag}'] = (
-            merged['IVPercentile_Expiry'] - merged['IVPercentile_Expiry_hist']
-        )
-        df[f'VolumePercentile_Change_L{lag}'] = (
-            merged['VolumePercentile_Expiry'] - merged['VolumePercentile_Expiry_hist']
-        )
-        df[f'OIPercentile_Change_L{lag}'] = (
-            merged['OIPercentile_Expiry'] - merged['OIPercentile_Expiry_hist']
-        )
+        features[:, self._percentile_dispatch[lag]] = current - hist_aligned
         
-        return df
+        return features
     
-    def _compute_volume_share_sma_vectorized(
+    def _compute_volume_share_sma(
         self,
-        df: pd.DataFrame,
-        hist_window: List[pd.DataFrame],
+        history_mgr: 'HistoryManager',
+        current_share: Tuple[pd.Index, np.ndarray],
+        keys: pd.Index,
         window: int
-    ) -> pd.Series:
+    ) -> np.ndarray:
+        """
+        Compute the volume share SMA of each row's contract over the window and the current minute.
+        
+        The mean is taken over every valid volume share of the contract in the
+        last `window` history minutes and the current minute. Window totals come
+        from HistoryManager.rolling_stats over the volume share snapshots, so
+        each minute costs one snapshot add and evict instead of a concat and
+        groupby over the whole window.
+        
+        Args:
+            history_mgr: HistoryManager instance providing the window statistics
+            current_share: Volume share snapshot of the current minute
+            keys: Contract keys of the current rows (see contract_keys)
+            window: Window size in minutes
+        
+        Returns:
+            Array of SMAs aligned with the current rows; NaN where the contract
+            has no valid volume share or the window has no contracts
         """
-        Vectorized computation of volume share SMA using concat and groupby.
+        stats_keys, count, mean, _ = history_mgr.rolling_stats(
+            window, self.VOLUME_SHARE_CACHE_KEY, self._volume_share_snapshot, 2
+        )
+        sma = np.full(len(keys), np.nan)
+        if len(stats_keys) == 0:
+            return sma
+        
+        # Window (sum, count) per contract: the mean of a per-minute total times
+        # the number of minutes it was seen in
+        totals = np.zeros((len(keys), 2))
+        rows = stats_keys.get_indexer(keys)
+        found = rows >= 0
+        window_count = count[rows[found]]
+        totals[found] = np.where(window_count > 0, mean[rows[found]], 0.0) * window_count
+        
+        current_keys, current_totals = current_share
+        rows = current_keys.get_indexer(keys)
+        found = rows >= 0
+        totals[found] += current_totals[rows[found]]
+        
+        np.divide(totals[:, 0], totals[:, 1], out=sma, where=totals[:, 1] > 0)
+        return sma
+    
+    def _volume_share_snapshot(
+        self, df: pd.DataFrame, keys: Optional[np.ndarray] = None, share: Optional[np.ndarray] = None
+    ) -> Tuple[pd.Index, np.ndarray]:
         """
-        # Concatenate all historical DataFrames with current
-        all_dfs = hist_window + [df[['expirDate', 'strike', 'VolumeShare_Expiry']].copy()]
-        combined = pd.concat(all_dfs, ignore_index=True)
+        Reduce a minute to per-contract volume share totals.
         
-        # Group by (expirDate, strike) and compute mean
-        sma_result = combined.groupby(['expirDate', 'strike'])['VolumeShare_Expiry'].mean()
+        Args:
+            df: Minute DataFrame (not modified)
+            keys: Contract keys of df rows, if already computed (see contract_keys)
+            share: Volume shares of df rows, if already computed (see
+                _compute_volume_share)
         
-        # Map back to original DataFrame
-        df_with_key = df.set_index(['expirDate', 'strike'])
-        result = df_with_key.index.map(lambda x: sma_result.get(x, np.nan))
+        Returns:
+            Tuple of (int64 contract key index, (contracts, 2) float64 matrix
+            of the sum and count of valid volume shares per contract); rows
+            without a valid key are dropped
+        """
+        if keys is None:
+            keys = contract_keys(df)
+        if share is None:
+            share = self._compute_volume_share(df, expiries)
         
-        return pd.Series(result, index=df.index)
+        valid = keys != INVALID_KEY
+        codes, uniques = pd.factorize(keys[valid], sort=False)
+        valid_share = share[valid]
+        totals = np.column_stack([
+            np.bincount(codes, weights=np.nan_to_num(valid_share, nan=0.0), minlength=len(uniques)),
+            np.bincount(codes, weights=~np.isnan(valid_share), minlength=len(uniques)),
+        ])
+        return pd.Index(uniques), totals
     
-    def _compute_volume_share(self, df: pd.DataFrame) -> pd.DataFrame:
+    def _compute_volume_share(
+        self, df: pd.DataFrame, expiries: Optional[Tuple[np.ndarray, pd.Index]] = None
+    ) -> np.ndarray:
         """
         Compute VolumeShare_Expiry for current minute.
         
         VolumeShare_Expiry = callVolume / sum(callVolume for all strikes in expiry)
         
         Args:
-            df: Input DataFrame
+            df: Input DataFrame (not modified)
+            expiries: Expiry factorization of df, if already computed (see
+                expiry_codes)
         
         Returns:
-            DataFrame with VolumeShare_Expiry added
+            Array of volume shares aligned with df rows; NaN where the expiry
+            has no call volume or is missing
         """
-        df_result = df.copy()
-        
-        # Group by expiry and compute volume share
-        for expiry, expiry_group in df_result.groupby('expirDate'):
-            # Get call volume for each row
-            call_volumes = expiry_group.get('callVolume', pd.Series(dtype=float))
-            
-            # Compute total volume for expiry
-            total_volume = call_volumes.sum()
-            
-            # Avoid division by zero
-            if total_volume > 0:
-                volume_shares = call_volumes / total_volume
-            else:
-                volume_shares = pd.Series(np.nan, index=expiry_group.index)
-            
-            # Assign to result
-            df_result.loc[expiry_group.index, 'VolumeShare_Expiry'] = volume_shares
-        
-        return df_result
-    
-
+        share = np.full(len(df), np.nan)
+        if 'callVolume' not in df.columns:
+            return share
+        
+        call_volumes = df['callVolume'].to_numpy(dtype=np.float64)
+        codes, uniques = expiry_codes(df) if expiries is None else expiries
+        
+        # Total call volume of each row's expiry (missing volumes count as 0,
+        # as in a groupby sum); rows without an expiry get no total
+        has_expiry = codes >= 0
+        totals = np.bincount(
+            codes[has_expiry],
+            weights=np.nan_to_num(call_volumes[has_expiry], nan=0.0),
+            minlength=len(uniques)
+        )
+        total_volume = np.zeros(len(df))
+        total_volume[has_expiry] = totals[codes[has_expiry]]
+        
+        # Divide only where the expiry has volume; other rows keep NaN
+        np.divide(call_volumes, total_volume, out=share, where=total_volume > 0)
+        return share
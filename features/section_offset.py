@@ -3,8 +3,10 @@
 import logging
 import pandas as pd
 import numpy as np
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from .contract_keys import EXPIRY_CODES_KEY, expiry_codes
 from .registry import FeatureSection
+from .window_stats import merged_zscore
 
 if TYPE_CHECKING:
     from ..history_manager import HistoryManager
@@ -18,6 +20,31 @@ class SectionOffsetFeatures(FeatureSection):
     # Offsets to compute features for
     OFFSETS = [-2, -1, 0, 1, 2]
     
+    # Columns read from each offset row, in offset table order
+    OFFSET_COLUMNS = ('CallIVMid', 'CallSpreadPct')
+    CHANGE_LAGS = (1, 5)
+    ZSCORE_WINDOWS = (5, 15)
+    
+    # HistoryManager derived-value key for per-minute offset tables
+    OFFSET_CACHE_KEY = 'offset_by_expiry'
+    
+    def __init__(self):
+        """Build the output-column dispatch table once (feature list is fixed)."""
+        self._feature_names = self.feature_names
+        col = {name: i for i, name in enumerate(self._feature_names)}
+        
+        # Output columns per offset, (OFFSETS, 7), in the value order built
+        # by compute
+        self._offset_dispatch = np.array([
+            [
+                col[f'IV_offsetChange_{offset}_L1'], col[f'IV_offsetChange_{offset}_L5'],
+                col[f'IV_offsetZ_{offset}_5'], col[f'IV_offsetZ_{offset}_15'],
+                col[f'IV_SkewToATM_{offset}'],
+                col[f'SpreadPct_offsetZ_{offset}_5'], col[f'SpreadPct_offsetZ_{offset}_15'],
+            ]
+            for offset in self.OFFSETS
+        ], dtype=np.intp)
+    
     @property
     def feature_names(self) -> list:
         """Return list of feature names in this section."""
@@ -42,247 +69,197 @@ class SectionOffsetFeatures(FeatureSection):
         
         return features
     
-    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager', **kwargs) -> pd.DataFrame:
+    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                out: Dict[str, np.ndarray], **kwargs) -> None:
         """
         Compute all Section 3 features using historical data.
         
+        The offset rows of every expiry are located once per frame (see
+        _offset_values_by_expiry); each lag frame is fetched from the history
+        once and window statistics come from HistoryManager.rolling_stats, so
+        changes, z-scores and skews are computed for all expiries and offsets
+        together without re-reducing the window every minute.
+        
         Args:
             df: Input DataFrame for current minute
             history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer receiving one array per feature
             **kwargs: Additional context (filename, etc.)
-        
-        Returns:
-            DataFrame with Section 3 features added
         """
         logger.info("Computing Section 3 features (Offset node lookback)")
         
-        df_result = df.copy()
+        # Output matrix (rows x features, C order), initialized with NaN
+        computed_features = self._feature_names
+        matrix = np.full((len(df), len(computed_features)), np.nan)
         
-        # Initialize all features with NaN
-        for feature in self.feature_names:
-            df_result[feature] = np.nan
+        # Expiry codes of the current rows, factorized once per minute; the
+        # offset tables are kept for this minute's history entry, so it is not
+        # scanned again
+        factorized = history_mgr.get_current_derived(df, EXPIRY_CODES_KEY, expiry_codes)
+        current_tables = history_mgr.get_current_derived(
+            df, self.OFFSET_CACHE_KEY, lambda minute_df: self._offset_values_by_expiry(minute_df, factorized)
+        )
         
-        # Group by expiry to compute offset features per expiry
-        for expiry, expiry_group in df_result.groupby('expirDate'):
-            # Get ATM IV for this expiry (offset 0)
-            atm_iv = self._get_offset_value(expiry_group, 0, 'CallIVMid')
-            
-            # Get all indices for this expiry (we'll broadcast features to all rows)
-            expiry_indices = expiry_group.index
-            
-            # Process each offset - compute once and broadcast to all rows in expiry
-            for offset in self.OFFSETS:
-                # Get current values for this offset
-                current_iv = self._get_offset_value(expiry_group, offset, 'CallIVMid')
-                current_spread = self._get_offset_value(expiry_group, offset, 'CallSpreadPct')
-                
-                # Skip if this offset doesn't exist in current data
-                if pd.isna(current_iv):
-                    continue
-                
-                # Compute features for this offset (scalar values)
-                iv_change_l1 = self._compute_offset_change(
-                    history_mgr, expiry, offset, current_iv, 'CallIVMid', lag=1
-                )
-                iv_change_l5 = self._compute_offset_change(
-                    history_mgr, expiry, offset, current_iv, 'CallIVMid', lag=5
-                )
-                iv_z_5 = self._compute_offset_zscore(
-                    history_mgr, expiry, offset, current_iv, 'CallIVMid', window=5
-                )
-                iv_z_15 = self._compute_offset_zscore(
-                    history_mgr, expiry, offset, current_iv, 'CallIVMid', window=15
+        # All expiries at once: every table is projected to (expiries, OFFSETS,
+        # OFFSET_COLUMNS) in the expiry order of df, and each expiry's values
+        # are broadcast to its rows through the factorized expiry codes
+        codes, expiries = factorized
+        current = self._stack_tables(current_tables, expiries)
+        
+        # Change features: value_t - value_{t-k} of CallIVMid for every offset,
+        # from the lag frames' tables (queue[-lag]) memoized in the history
+        changes = {
+            lag: current[..., 0] - self._stack_tables(
+                history_mgr.get_derived(lag, self.OFFSET_CACHE_KEY, self._offset_values_by_expiry), expiries
+            )[..., 0]
+            for lag in self.CHANGE_LAGS
+        }
+        
+        # Z-score features for every (window, expiry, offset, column) in one
+        # kernel call, from the history's running window sums of the offset
+        # tables; windows the history cannot serve keep count 0 and stay NaN
+        history_size = history_mgr.get_current_size()
+        stats_shape = (len(self.ZSCORE_WINDOWS),) + current.shape
+        count = np.zeros(stats_shape)
+        mean = np.full(stats_shape, np.nan)
+        var = np.full(stats_shape, np.nan)
+        for window_idx, window in enumerate(self.ZSCORE_WINDOWS):
+            if window <= history_size:
+                stats = history_mgr.rolling_stats(
+                    window, self.OFFSET_CACHE_KEY, self._offset_values_by_expiry,
+                    len(self.OFFSETS) * len(self.OFFSET_COLUMNS)
                 )
-                iv_skew = current_iv - atm_iv if not pd.isna(atm_iv) else np.nan
-                
-                spread_z_5 = self._compute_offset_zscore(
-                    history_mgr, expiry, offset, current_spread, 'CallSpreadPct', window=5
-                ) if not pd.isna(current_spread) else np.nan
-                spread_z_15 = self._compute_offset_zscore(
-                    history_mgr, expiry, offset, current_spread, 'CallSpreadPct', window=15
-                ) if not pd.isna(current_spread) else np.nan
-                
-                # Broadcast these values to ALL rows in this expiry
-                df_result.loc[expiry_indices, f'IV_offsetChange_{offset}_L1'] = iv_change_l1
-                df_result.loc[expiry_indices, f'IV_offsetChange_{offset}_L5'] = iv_change_l5
-                df_result.loc[expiry_indices, f'IV_offsetZ_{offset}_5'] = iv_z_5
-                df_result.loc[expiry_indices, f'IV_offsetZ_{offset}_15'] = iv_z_15
-                df_result.loc[expiry_indices, f'IV_SkewToATM_{offset}'] = iv_skew
-                df_result.loc[expiry_indices, f'SpreadPct_offsetZ_{offset}_5'] = spread_z_5
-                df_result.loc[expiry_indices, f'SpreadPct_offsetZ_{offset}_15'] = spread_z_15
+                self._stack_stats(stats, expiries, count[window_idx], mean[window_idx], var[window_idx])
+        zscores = dict(zip(self.ZSCORE_WINDOWS, merged_zscore(current, count, mean, var)))
+        
+        # Skew to the ATM (offset 0) IV of each expiry
+        atm_offset_idx = self.OFFSETS.index(0)
+        skew = current[..., 0] - current[:, atm_offset_idx, 0][:, np.newaxis]
+        
+        # (expiries, OFFSETS, 7) values in _offset_dispatch column order;
+        # offsets missing from the current data (NaN IV) stay NaN
+        values = np.stack([
+            changes[1], changes[5],
+            zscores[5][..., 0], zscores[15][..., 0],
+            skew,
+            zscores[5][..., 1], zscores[15][..., 1],
+        ], axis=-1)
+        values[np.isnan(current[..., 0])] = np.nan
+        
+        # Broadcast per-expiry values to ALL rows in that expiry
+        rows = np.flatnonzero(codes >= 0)
+        matrix[np.ix_(rows, self._offset_dispatch.ravel())] = values.reshape(len(expiries), -1)[codes[rows]]
         
         # Round all computed features to 4 decimals
-        computed_features = self.feature_names
-        df_result[computed_features] = df_result[computed_features].round(4)
+        np.round(matrix, 4, out=matrix)
+        for col_idx, name in enumerate(computed_features):
+            out[name] = matrix[:, col_idx]
         
         logger.info(f"Section 3 features computed: {len(computed_features)} features")
-        
-        return df_result
     
-    def _get_offset_value(self, expiry_group: pd.DataFrame, offset: int, column: str) -> Optional[float]:
+    def _offset_values_by_expiry(
+        self, df: pd.DataFrame, expiries: Optional[Tuple[np.ndarray, pd.Index]] = None
+    ) -> Tuple[pd.Index, np.ndarray]:
         """
-        Get value for a specific offset within an expiry group.
+        Locate the offset rows of every expiry in a minute frame.
+        
+        For each offset the first row (in frame order) with that
+        distance_to_atm is used. Rows are stably sorted once by (expiry,
+        distance_to_atm), so each expiry is a contiguous run and every offset
+        is found by binary search within it. Missing offsets and value
+        columns read as NaN.
         
         Args:
-            expiry_group: DataFrame subset for a single expiry
-            offset: distance_to_atm offset value
-            column: Column name to extract
+            df: Minute DataFrame
+            expiries: Expiry factorization of df, if already computed (see
+                expiry_codes)
         
         Returns:
-            Value at offset or NaN if not found
+            Tuple of (expiries, tables): an Index of expiries and the matching
+            (expiries, OFFSETS * OFFSET_COLUMNS) float64 array, offset-major, so
+            the tables are a keyed snapshot for HistoryManager.rolling_stats
         """
+        empty = (pd.Index([]), np.empty((0, len(self.OFFSETS) * len(self.OFFSET_COLUMNS))))
+        if df is None or df.empty:
+            return empty
+        
         try:
-            offset_rows = expiry_group[expiry_group['distance_to_atm'] == offset]
-            
-            if offset_rows.empty:
-                return np.nan
-            
-            # Take first row if multiple (shouldn't happen but be safe)
-            value = offset_rows.iloc[0].get(column, np.nan)
-            return value if not pd.isna(value) else np.nan
-        except (KeyError, IndexError):
-            return np.nan
-    
-    def _get_historical_offset_value(
-        self,
-        hist_df: pd.DataFrame,
-        expiry: str,
-        offset: int,
-        column: str
-    ) -> Optional[float]:
-        """
-        Extract offset value for a specific expiry from historical DataFrame.
+            distance = df['distance_to_atm'].to_numpy(dtype=np.float64)
+            codes, uniques = expiry_codes(df) if expiries is None else expiries
+        except (KeyError, ValueError, TypeError) as e:
+            logger.debug(f"Error extracting offset values: {e}")
+            return empty
         
-        Args:
-            hist_df: Historical DataFrame
-            expiry: Expiry date to filter
-            offset: distance_to_atm offset value
-            column: Column name to extract
+        values = np.column_stack([
+            df[col].to_numpy(dtype=np.float64) if col in df.columns else np.full(len(df), np.nan)
+            for col in self.OFFSET_COLUMNS
+        ])
         
-        Returns:
-            Offset value or None if not found
-        """
-        try:
-            # Filter for the specific expiry and offset
-            offset_data = hist_df[(hist_df['expirDate'] == expiry) & (hist_df['distance_to_atm'] == offset)]
-            
-            if offset_data.empty:
-                return None
+        # Stable sort by (expiry code, distance); ties keep frame order
+        order = np.lexsort((distance, codes))
+        sorted_codes = codes[order]
+        sorted_distance = distance[order]
+        offsets = np.asarray(self.OFFSETS, dtype=np.float64)
+        
+        # Run boundaries of each expiry code (code -1 marks a missing expiry)
+        run_bounds = np.searchsorted(sorted_codes, np.arange(len(uniques) + 1))
+        
+        tables = np.full((len(uniques), len(self.OFFSETS), len(self.OFFSET_COLUMNS)), np.nan)
+        for code in range(len(uniques)):
+            start, end = run_bounds[code], run_bounds[code + 1]
+            run_distance = sorted_distance[start:end]
             
-            # Take first row if multiple
-            offset_value = offset_data.iloc[0].get(column, np.nan)
+            # First row at or after each offset; a hit only if it matches exactly
+            hits = np.searchsorted(run_distance, offsets)
+            found = hits < len(run_distance)
+            found[found] = run_distance[hits[found]] == offsets[found]
             
-            return offset_value if not pd.isna(offset_value) else None
-        except (KeyError, IndexError):
-            return None
+            tables[code, found] = values[order[start + hits[found]]]
+        return uniques, tables.reshape(len(uniques), -1)
     
-    def _compute_offset_change(
-        self,
-        history_mgr: 'HistoryManager',
-        expiry: str,
-        offset: int,
-        current_value: float,
-        column: str,
-        lag: int
-    ) -> float:
+    def _stack_tables(self, tables: Optional[Tuple[pd.Index, np.ndarray]], expiries: pd.Index) -> np.ndarray:
         """
-        Compute change in offset value over lag k: value_t - value_{t-k}.
+        Project one frame's offset tables onto a fixed expiry order.
         
         Args:
-            history_mgr: HistoryManager instance
-            expiry: Expiry date
-            offset: distance_to_atm offset value
-            current_value: Current offset value
-            column: Column name to extract from history
-            lag: Number of minutes to look back
+            tables: Offset tables (see _offset_values_by_expiry), or None if
+                the frame is unavailable
+            expiries: Expiry order of the output
         
         Returns:
-            Change value or NaN if insufficient history
+            (expiries, OFFSETS, OFFSET_COLUMNS) array, NaN where an expiry is missing
         """
-        # Check if we have enough history
-        if history_mgr.get_current_size() < lag:
-            return np.nan
+        stacked = np.full((len(expiries), len(self.OFFSETS), len(self.OFFSET_COLUMNS)), np.nan)
+        if tables is None or len(tables[0]) == 0:
+            return stacked
         
-        # Check if current value is valid
-        if pd.isna(current_value):
-            return np.nan
-        
-        try:
-            # Get historical DataFrame
-            if lag > len(history_mgr.queue):
-                return np.nan
-            
-            index = -lag
-            hist_df = list(history_mgr.queue)[index][3]
-            
-            if hist_df is None or hist_df.empty:
-                return np.nan
-            
-            # Extract historical offset value
-            historical_value = self._get_historical_offset_value(hist_df, expiry, offset, column)
-            
-            if historical_value is None:
-                return np.nan
-            
-            # Compute change
-            return current_value - historical_value
-        except (KeyError, IndexError):
-            return np.nan
+        table_expiries, values = tables
+        rows = table_expiries.get_indexer(expiries)
+        found = rows >= 0
+        stacked[found] = values[rows[found]].reshape((-1,) + stacked.shape[1:])
+        return stacked
     
-    def _compute_offset_zscore(
+    def _stack_stats(
         self,
-        history_mgr: 'HistoryManager',
-        expiry: str,
-        offset: int,
-        current_value: float,
-        column: str,
-        window: int
-    ) -> float:
+        stats: Tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray],
+        expiries: pd.Index,
+        count: np.ndarray,
+        mean: np.ndarray,
+        var: np.ndarray
+    ) -> None:
         """
-        Compute z-score of offset value over window N: (value - mean) / std.
+        Project window statistics of the offset tables onto a fixed expiry order.
         
         Args:
-            history_mgr: HistoryManager instance
-            expiry: Expiry date
-            offset: distance_to_atm offset value
-            current_value: Current offset value
-            column: Column name to extract from history
-            window: Window size in minutes
-        
-        Returns:
-            Z-score or NaN if insufficient history
+            stats: (keys, count, mean, var) from HistoryManager.rolling_stats
+            expiries: Expiry order of the output
+            count: (expiries, OFFSETS, OFFSET_COLUMNS) output, left untouched
+                (0) where an expiry is missing from the window
+            mean: Output like count, left untouched (NaN) for missing expiries
+            var: Output like count, left untouched (NaN) for missing expiries
         """
-        window_dfs = history_mgr.get_window(window)
-        
-        if len(window_dfs) < window:
-            return np.nan
-        
-        # Check if current value is valid
-        if pd.isna(current_value):
-            return np.nan
-        
-        try:
-            # Extract offset values from window
-            values = []
-            for hist_df in window_dfs:
-                hist_value = self._get_historical_offset_value(hist_df, expiry, offset, column)
-                if hist_value is not None:
-                    values.append(hist_value)
-            
-            # Add current value
-            values.append(current_value)
-            
-            if len(values) < 2:
-                return np.nan
-            
-            # Compute z-score
-            mean = np.mean(values)
-            std = np.std(values, ddof=1)
-            
-            # Avoid division by zero
-            if std < 1e-6:
-                return np.nan
-            
-            return (current_value - mean) / std
-        except (KeyError, IndexError):
-            return np.nan
+        stats_expiries = stats[0]
+        rows = stats_expiries.get_indexer(expiries)
+        found = rows >= 0
+        for target, source in zip((count, mean, var), stats[1:]):
+            target[found] = source[rows[found]].reshape((-1,) + target.shape[1:])
@@ -3,7 +3,7 @@
 import logging
 import pandas as pd
 import numpy as np
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Dict, Tuple
 from .registry import FeatureSection
 
 if TYPE_CHECKING:
@@ -12,9 +12,101 @@ if TYPE_CHECKING:
 logger = logging.getLogger(__name__)
 
 
+def _ema_kernel(prices: np.ndarray, span: int) -> float:
+    """
+    Compute the exponential moving average at the last price: y = alpha * x + (1 - alpha) * y_prev.
+    
+    A scalar recurrence with alpha = 2 / (span + 1), the same computation as
+    pandas ewm(span=span, adjust=False).mean() without building a Series.
+    Terms are normalized and a missing price carries the previous average
+    forward exactly as pandas does, so results match it bit for bit.
+    
+    Args:
+        prices: Window prices, oldest first
+        span: EMA span in minutes
+    
+    Returns:
+        Exponential moving average at the last price
+    """
+    alpha = 1.0 / (1.0 + (span - 1) / 2.0)
+    decay = 1.0 - alpha
+    values = prices.tolist()
+    ema = values[0]
+    for price in values[1:]:
+        if price != price:
+            continue
+        if ema != price:
+            ema = (decay * ema + alpha * price) / (decay + alpha)
+    return ema
+
+
+def _underlying_kernel(prices: np.ndarray, log_prices: np.ndarray, return_lags: np.ndarray,
+                       windows: Tuple[int, ...]) -> np.ndarray:
+    """
+    Compute every underlying feature of a minute from its price tail.
+    
+    Args:
+        prices: History prices oldest first with the current price last, so
+            prices[-1 - k] is the price k minutes back; NaN where unreadable
+        log_prices: Logs of prices, NaN unless the price is positive
+        return_lags: Lags of the log return features
+        windows: Windows of the SMA, EMA and volatility features
+    
+    Returns:
+        float64 array: ln(price_t / price_{t-k}) per return lag, then the SMA,
+        EMA and realized volatility sqrt(sum(ln(price_i / price_{i-1})^2)) per
+        window. Returns are NaN without history or with a non-positive price;
+        window features are NaN if the window has an unreadable history price,
+        and volatility also if no pair of the window has positive prices
+    """
+    n_windows = len(windows)
+    values = np.full(len(return_lags) + 3 * n_windows, np.nan)
+    current_price = prices[-1]
+    
+    # Log returns of every lag the history covers, as differences of
+    # cached logs
+    covered = return_lags < len(prices)
+    historical = prices[-1 - return_lags[covered]]
+    usable = ~((historical <= 0) | (current_price <= 0))
+    values[:len(return_lags)][covered] = np.where(
+        usable, log_prices[-1] - log_prices[-1 - return_lags[covered]], np.nan
+    )
+    
+    # Suffix sums of squared log returns over the price tail: element k
+    # covers the last k + 1 pairs, so the volatility of every window is a
+    # single lookup; a missing price only reaches the windows that contain
+    # it. Pairs with a non-positive price add nothing
+    previous, following = prices[:-1], prices[1:]
+    usable = ~((previous <= 0) | (following <= 0))
+    squared_returns = np.where(usable, np.diff(log_prices) ** 2, 0.0)
+    squared_return_sums = np.cumsum(squared_returns[::-1])
+    usable_counts = np.cumsum(usable[::-1])
+    
+    sma, ema, volatility = (values[len(return_lags) + i * n_windows:][:n_windows] for i in range(3))
+    for window_idx, window in enumerate(windows):
+        window_prices = prices[-window - 1:]
+        if len(prices) <= window or np.isnan(window_prices[:-1]).any():
+            continue
+        
+        # SMAs stay slice means: averages of cent prices often land exactly
+        # on a 4-decimal tie, which must keep rounding as np.mean's sum does
+        sma[window_idx] = window_prices.mean()
+        ema[window_idx] = _ema_kernel(window_prices, window)
+        if usable_counts[window - 1]:
+            volatility[window_idx] = np.sqrt(squared_return_sums[window - 1])
+    
+    return values
+
+
 class SectionUnderlyingFeatures(FeatureSection):
     """Implements Section 2.1 features (Underlying stock price lookback)."""
     
+    # Lags of the return features and windows of the cumulative return,
+    # SMA, EMA and volatility features
+    LAGS = (1, 5, 15)
+    CUM_RETURN_WINDOWS = (5, 15, 30)
+    WINDOWS = (5, 15, 30)
+    
     @property
     def feature_names(self) -> list:
         """Return list of feature names in this section."""
@@ -31,189 +123,55 @@ class SectionUnderlyingFeatures(FeatureSection):
             'UnderlyingVol_5', 'UnderlyingVol_15', 'UnderlyingVol_30'
         ]
     
-    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager', **kwargs) -> pd.DataFrame:
+    def __init__(self):
+        """Build the kernel inputs and output names once (feature list is fixed)."""
+        self._feature_names = self.feature_names
+        self._max_lookback = max(self.LAGS + self.CUM_RETURN_WINDOWS + self.WINDOWS)
+        
+        # Cumulative returns over these windows are the lag returns of the
+        # same length, so both are kernel return lags
+        self._return_lags = np.array(self.LAGS + self.CUM_RETURN_WINDOWS, dtype=np.intp)
+        # Feature name of each kernel output, in kernel order
+        self._kernel_names = (
+            [f'UnderlyingReturn_L{lag}' for lag in self.LAGS]
+            + [f'UnderlyingCumReturn_{window}' for window in self.CUM_RETURN_WINDOWS]
+            + [f'Underlying{name}_{window}' for name in ('SMA', 'EMA', 'Vol') for window in self.WINDOWS]
+        )
+    
+    def compute(self, df: pd.DataFrame, history_mgr: 'HistoryManager',
+                out: Dict[str, np.ndarray], **kwargs) -> None:
         """
         Compute all Section 2.1 features using historical data.
         
+        The history prices of the longest lookback are read once from the
+        history's price buffer (see HistoryManager.get_window_prices) and
+        every feature is computed from that one array by _underlying_kernel.
+        
         Args:
             df: Input DataFrame for current minute
             history_mgr: HistoryManager instance providing access to historical data
+            out: Output buffer receiving one array per feature
             **kwargs: Additional context (filename, etc.)
-        
-        Returns:
-            DataFrame with Section 2.1 features added
         """
         logger.info("Computing Section 2.1 features (Underlying lookback)")
         
-        df_result = df.copy()
-        
         # Extract current stock price (same for all rows in the minute)
-        current_price = df_result['stockPrice'].iloc[0]
-        
-        # Compute lag return features
-        df_result['UnderlyingReturn_L1'] = self._compute_lag_return(history_mgr, current_price, lag=1)
-        df_result['UnderlyingReturn_L5'] = self._compute_lag_return(history_mgr, current_price, lag=5)
-        df_result['UnderlyingReturn_L15'] = self._compute_lag_return(history_mgr, current_price, lag=15)
-        
-        # Compute cumulative return features (same as lag returns for these windows)
-        df_result['UnderlyingCumReturn_5'] = self._compute_lag_return(history_mgr, current_price, lag=5)
-        df_result['UnderlyingCumReturn_15'] = self._compute_lag_return(history_mgr, current_price, lag=15)
-        df_result['UnderlyingCumReturn_30'] = self._compute_lag_return(history_mgr, current_price, lag=30)
-        
-        # Compute simple moving average features
-        df_result['UnderlyingSMA_5'] = self._compute_sma(history_mgr, current_price, window=5)
-        df_result['UnderlyingSMA_15'] = self._compute_sma(history_mgr, current_price, window=15)
-        df_result['UnderlyingSMA_30'] = self._compute_sma(history_mgr, current_price, window=30)
+        current_price = df['stockPrice'].iat[0]
         
-        # Compute exponential moving average features
-        df_result['UnderlyingEMA_5'] = self._compute_ema(history_mgr, current_price, window=5)
-        df_result['UnderlyingEMA_15'] = self._compute_ema(history_mgr, current_price, window=15)
-        df_result['UnderlyingEMA_30'] = self._compute_ema(history_mgr, current_price, window=30)
-        
-        # Compute volatility features
-        df_result['UnderlyingVol_5'] = self._compute_volatility(history_mgr, current_price, window=5)
-        df_result['UnderlyingVol_15'] = self._compute_volatility(history_mgr, current_price, window=15)
-        df_result['UnderlyingVol_30'] = self._compute_volatility(history_mgr, current_price, window=30)
-        
-        # Round all computed features to 4 decimals
-        computed_features = self.feature_names
-        df_result[computed_features] = df_result[computed_features].round(4)
-        
-        logger.info(f"Section 2.1 features computed: {len(computed_features)} features")
-        
-        return df_result
-    
-    def _compute_lag_return(self, history_mgr: 'HistoryManager', current_price: float, lag: int) -> float:
-        """
-        Compute log return over lag k: ln(price_t / price_{t-k}).
+        # History prices and their cached logs, oldest first with the current
+        # price appended
+        prices = np.append(history_mgr.get_window_prices(self._max_lookback), current_price)
+        log_prices = np.append(
+            history_mgr.get_window_log_prices(self._max_lookback),
+            np.log(current_price) if current_price > 0 else np.nan
+        )
+        if len(prices) <= self._max_lookback:
+            logger.debug(f"History has {len(prices) - 1} prices: longer lookbacks are NaN")
         
-        Args:
-            history_mgr: HistoryManager instance
-            current_price: Current stock price
-            lag: Number of minutes to look back
-        
-        Returns:
-            Log return or NaN if insufficient history
-        """
-        # Check if we have enough history
-        if history_mgr.get_current_size() < lag:
-            logger.debug(f"Insufficient history for lag {lag}, returning NaN")
-            return np.nan
-        
-        # Get the DataFrame from lag minutes ago
-        # queue[-1] is most recent, queue[-2] is 1 minute ago, etc.
-        # For lag=1, we want queue[-1] (most recent in history)
-        # For lag=k, we want queue[-k]
-        try:
-            index = -lag
-            hist_df = list(history_mgr.queue)[index][3]
-            
-            if hist_df is None or hist_df.empty:
-                logger.debug(f"Empty history for lag {lag}, returning NaN")
-                return np.nan
-            
-            historical_price = hist_df['stockPrice'].iloc[0]
-            if historical_price <= 0 or current_price <= 0:
-                return np.nan
-            return np.log(current_price / historical_price)
-        except (KeyError, IndexError):
-            logger.debug(f"Error extracting historical price for lag {lag}")
-            return np.nan
-    
-    def _compute_sma(self, history_mgr: 'HistoryManager', current_price: float, window: int) -> float:
-        """
-        Compute simple moving average over window N.
-        
-        Args:
-            history_mgr: HistoryManager instance
-            current_price: Current stock price
-            window: Window size in minutes
-        
-        Returns:
-            Simple moving average or NaN if insufficient history
-        """
-        window_dfs = history_mgr.get_window(window)
-        
-        if len(window_dfs) < window:
-            logger.debug(f"Insufficient history for SMA window {window}, returning NaN")
-            return np.nan
-        
-        try:
-            # Extract prices from window (including current)
-            prices = [df['stockPrice'].iloc[0] for df in window_dfs]
-            prices.append(current_price)
-            return np.mean(prices)
-        except (KeyError, IndexError):
-            logger.debug(f"Error computing SMA for window {window}")
-            return np.nan
-    
-    def _compute_ema(self, history_mgr: 'HistoryManager', current_price: float, window: int) -> float:
-        """
-        Compute exponential moving average over window N using pandas EMA.
-        
-        Args:
-            history_mgr: HistoryManager instance
-            current_price: Current stock price
-            window: Window size in minutes (span parameter)
-        
-        Returns:
-            Exponential moving average or NaN if insufficient history
-        """
-        window_dfs = history_mgr.get_window(window)
-        
-        if len(window_dfs) < window:
-            logger.debug(f"Insufficient history for EMA window {window}, returning NaN")
-            return np.nan
-        
-        try:
-            # Extract prices from window (including current)
-            prices = [df['stockPrice'].iloc[0] for df in window_dfs]
-            prices.append(current_price)
-            
-            # Compute EMA using pandas
-            price_series = pd.Series(prices)
-            ema_series = price_series.ewm(span=window, adjust=False).mean()
-            return ema_series.iloc[-1]
-        except (KeyError, IndexError):
-            logger.debug(f"Error computing EMA for window {window}")
-            return np.nan
-    
-    def _compute_volatility(self, history_mgr: 'HistoryManager', current_price: float, window: int) -> float:
-        """
-        Compute realized volatility: sqrt(sum((ln(price_i / price_{i-1}))^2)).
-        
-        Args:
-            history_mgr: HistoryManager instance
-            current_price: Current stock price
-            window: Window size in minutes
-        
-        Returns:
-            Realized volatility or NaN if insufficient history
-        """
-        window_dfs = history_mgr.get_window(window)
+        values = np.round(_underlying_kernel(prices, log_prices, self._return_lags, self.WINDOWS), 4)
         
-        if len(window_dfs) < window:
-            logger.debug(f"Insufficient history for volatility window {window}, returning NaN")
-            return np.nan
+        # Broadcast the scalar features to every row, rounded to 4 decimals
+        for name, value in zip(self._kernel_names, values):
+            out[name] = np.full(len(df), value, dtype=np.float64)
         
-        try:
-            # Extract prices from window (including current)
-            prices = [df['stockPrice'].iloc[0] for df in window_dfs]
-            prices.append(current_price)
-            
-            # Compute log returns
-            returns = []
-            for i in range(1, len(prices)):
-                if prices[i-1] <= 0 or prices[i] <= 0:
-                    continue
-                log_return = np.log(prices[i] / prices[i-1])
-                returns.append(log_return ** 2)
-            
-            if len(returns) == 0:
-                return np.nan
-            
-            # Compute volatility as sqrt(sum(returns^2))
-            return np.sqrt(np.sum(returns))
-        except (KeyError, IndexError):
-            logger.debug(f"Error computing volatility for window {window}")
-            return np.nan
+        logger.info(f"Section 2.1 features computed: {len(self._feature_names)} features")
@@ -0,0 +1,33 @@
+"""Z-scores over rolling window statistics shared by the lookback sections."""
+
+import numpy as np
+
+
+def merged_zscore(current: np.ndarray, count: np.ndarray, mean: np.ndarray, var: np.ndarray) -> np.ndarray:
+    """
+    Compute z-scores of current values over their window plus the current value.
+    
+    The current value is merged into the window statistics as one more
+    observation (pairwise mean/variance update), so the sample std is taken
+    over the valid window values and the current value.
+    
+    Args:
+        current: Current values; broadcast against the statistics
+        count: Valid window values per entry
+        mean: Window means, NaN where count is 0
+        var: Window sample variances (ddof=1), NaN where count < 2
+    
+    Returns:
+        Z-scores with the shape of the statistics; NaN where the current value
+        is missing, the window is empty or the std is below 1e-6
+    """
+    has_history = count > 0
+    delta = np.where(has_history, current - mean, 0.0)
+    # Deviation of the current value from the merged mean, and the merged sum
+    # of squared deviations over count + 1 values
+    deviation = delta * count / (count + 1)
+    sq_dev = np.where(count > 1, var * (count - 1), 0.0) + delta * deviation
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(sq_dev / count)
+        zscore = deviation / std
+    return np.where(~np.isnan(current) & has_history & (std >= 1e-6), zscore, np.nan)
@@ -1,15 +1,19 @@
 """Main Lambda handler for SPY History Features Lambda."""
 
+import base64
+import bisect
+import gzip
+import json
 import logging
 import time
 import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import numpy as np
 import pandas as pd
-import boto3
-from botocore.config import Config as BotocoreConfig
 
-from config import Config
+from config import Config, validate as validate_config
 from s3_manager import S3Manager
 from history_manager import HistoryManager
 from feature_engine import FeatureEngine
@@ -20,6 +24,39 @@ from utils import parse_cache_key
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Feature registry and its version hash, built once per container: the
+# registered sections are fixed for the deployed code and hold no per-file
+# state, so warm invocations reuse them
+_REGISTRY = None
+_VERSION_HASH = None
+
+# S3 manager (and its pooled boto3 client), also reused by warm invocations
+_S3_MANAGER = None
+
+
+def _get_registry():
+    """Return the container's feature registry, creating it on first use."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = create_default_registry()
+    return _REGISTRY
+
+
+def _get_version_hash() -> str:
+    """Return the feature version hash of the container's registry."""
+    global _VERSION_HASH
+    if _VERSION_HASH is None:
+        _VERSION_HASH = _get_registry().compute_version_hash()
+    return _VERSION_HASH
+
+
+def _get_s3_manager() -> S3Manager:
+    """Return the container's S3 manager, creating it on first use."""
+    global _S3_MANAGER
+    if _S3_MANAGER is None:
+        _S3_MANAGER = S3Manager()
+    return _S3_MANAGER
+
 
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -28,9 +65,17 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     Event Structure:
     {
         "s3_uris": ["s3://...", "s3://..."],
-        "mode": "batch" | "live"  # default: "batch"
+        "mode": "batch" | "live",  # default: "batch"
+        "result_uri": "s3://..."    # optional: also write batch result here
     }
     
+    Large URI lists may arrive as "s3_uris_gz" (base64 gzip'd JSON list).
+    
+    A {"warmup": true} event returns immediately (container pre-warming).
+    
+    When result_uri is set (asynchronous 'Event' invocations, whose return
+    value is discarded), the batch result is written to that S3 URI.
+    
     Args:
         event: Lambda event containing s3_uris and mode
         context: Lambda context object
@@ -41,6 +86,22 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     start_time = time.time()
     
+    # Warmup ping from the batch processor: container is initialized, nothing to do
+    if event.get('warmup'):
+        return {'warmup': True}
+    
+    # Restore the URI list before the fatal-error path below, which reports
+    # the event's URIs as unprocessed. If it cannot be restored there is
+    # nothing to report, so fail the invocation outright: the caller then
+    # marks the whole batch failed (FunctionError, or the published error)
+    try:
+        event = decode_event(event)
+    except Exception as e:
+        logger.error(f"Failed to decode s3_uris_gz: {e}")
+        publish_result(event, {'errorType': type(e).__name__,
+                               'errorMessage': f"Failed to decode s3_uris_gz: {e}"})
+        raise
+    
     try:
         # Parse event
         mode = event.get('mode', 'batch')
@@ -59,19 +120,18 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             raise ValueError(f"Live mode requires exactly 1 S3 URI, got {len(s3_uris)}")
         
         # Validate configuration
-        Config.validate()
+        validate_config()
         
         # Initialize components
         logger.info("Initializing components...")
-        s3_mgr = S3Manager()
-        history_mgr = HistoryManager(window_size=Config.get_history_window_size())
-        registry = create_default_registry()
-        engine = FeatureEngine(registry)
+        s3_mgr = _get_s3_manager()
+        history_mgr = HistoryManager(window_size=Config.HISTORY_WINDOW_SIZE)
+        engine = FeatureEngine(_get_registry(), max_workers=Config.SECTION_WORKERS)
         
-        logger.info(f"HistoryManager initialized: window_size={Config.get_history_window_size()}")
+        logger.info(f"HistoryManager initialized: window_size={Config.HISTORY_WINDOW_SIZE}")
         
         # Calculate timeout threshold (Lambda timeout - buffer)
-        timeout_buffer = Config.get_timeout_buffer()
+        timeout_buffer = Config.TIMEOUT_BUFFER_SECONDS
         remaining_time_ms = context.get_remaining_time_in_millis()
         timeout_threshold = (remaining_time_ms / 1000) - timeout_buffer
         
@@ -85,8 +145,16 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'unprocessed_files': []
         }
         
+        # Batch files are processed in order (each minute's features depend on
+        # the previous minutes), but the next file's parquet is read while the
+        # current one is computed and written
+        reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch') if mode == 'batch' else None
+        next_read = reader.submit(s3_mgr.read_parquet, s3_uris[0]) if reader else None
+        
         # Process files
         for idx, uri in enumerate(s3_uris):
+            current_read = next_read
+            
             # Check timeout
             elapsed = time.time() - start_time
             if elapsed > timeout_threshold:
@@ -94,11 +162,15 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 results['unprocessed_files'] = s3_uris[idx:]
                 break
             
+            if reader and idx + 1 < len(s3_uris):
+                next_read = reader.submit(s3_mgr.read_parquet, s3_uris[idx + 1])
+            
             try:
                 logger.info(f"Processing file {idx + 1}/{len(s3_uris)}: {uri}")
                 
                 # Process single file
-                result = process_file(uri, engine, s3_mgr, history_mgr, mode, start_time)
+                result = process_file(uri, engine, s3_mgr, history_mgr, mode, start_time,
+                                      df_read=current_read)
                 
                 # Live mode: return immediately
                 if mode == 'live':
@@ -123,6 +195,10 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 # Continue processing remaining files in batch mode
                 continue
         
+        # Drop a read-ahead left over after a timeout stop
+        if reader:
+            reader.shutdown(wait=False, cancel_futures=True)
+        
         # Log final statistics
         total_elapsed = time.time() - start_time
         logger.info(f"Processing complete: {results['success_count']} succeeded, "
@@ -130,6 +206,8 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                    f"{len(results['unprocessed_files'])} unprocessed, "
                    f"elapsed={total_elapsed:.2f}s")
         
+        publish_result(event, results, s3_mgr)
+        
         return results
         
     except Exception as e:
@@ -137,7 +215,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         logger.error(f"Fatal error in lambda_handler: {e}")
         logger.error(traceback.format_exc())
         
-        return {
+        results = {
             'success_count': 0,
             'failure_count': len(event.get('s3_uris', [])),
             'failures': [{
@@ -147,6 +225,51 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }],
             'unprocessed_files': event.get('s3_uris', [])
         }
+        
+        publish_result(event, results)
+        
+        return results
+
+
+def decode_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Restore a compressed URI list ('s3_uris_gz') to 's3_uris'.
+    
+    Args:
+        event: Lambda event, possibly with a base64 gzip'd JSON URI list
+    
+    Returns:
+        Event with plain 's3_uris'
+    """
+    if 's3_uris_gz' not in event:
+        return event
+    
+    decoded = {k: v for k, v in event.items() if k != 's3_uris_gz'}
+    decoded['s3_uris'] = json.loads(gzip.decompress(base64.b64decode(event['s3_uris_gz'])))
+    return decoded
+
+
+def publish_result(event: Dict[str, Any], results: Dict[str, Any],
+                   s3_mgr: Optional[S3Manager] = None) -> None:
+    """
+    Write batch results to event['result_uri'] for asynchronous callers.
+    
+    No-op when the event has no result_uri. Errors are logged, not raised,
+    so a failed publish never masks the batch outcome.
+    
+    Args:
+        event: Lambda event
+        results: Batch result dictionary
+        s3_mgr: S3Manager instance (created if not provided)
+    """
+    result_uri = event.get('result_uri')
+    if not result_uri:
+        return
+    
+    try:
+        (s3_mgr or _get_s3_manager()).write_json(results, result_uri)
+    except Exception as e:
+        logger.error(f"Failed to publish result to {result_uri}: {e}")
 
 
 def load_historical_context(uri: str, s3_mgr: S3Manager, history_mgr: HistoryManager, 
@@ -163,7 +286,6 @@ def load_historical_context(uri: str, s3_mgr: S3Manager, history_mgr: HistoryMan
         history_mgr: HistoryManager instance
         max_history_minutes: Maximum number of historical minutes to load
     """
-    import boto3
     from datetime import datetime, timedelta
     
     # Extract date and minute from current URI
@@ -174,19 +296,12 @@ def load_historical_context(uri: str, s3_mgr: S3Manager, history_mgr: HistoryMan
     current_dt = datetime.strptime(f"{current_date}{current_minute}", "%Y%m%d%H%M")
     
     # Determine how many minutes to load (up to max_history_minutes)
-    minutes_to_load = min(max_history_minutes, Config.get_history_window_size())
+    minutes_to_load = min(max_history_minutes, Config.HISTORY_WINDOW_SIZE)
     
     logger.info(f"Loading up to {minutes_to_load} minutes of historical context before {current_date} {current_minute}")
     
     # Build index of available S3 files by listing dates around current date
-    bucket = Config.get_source_bucket()
-    
-    # Configure S3 client with larger connection pool
-    s3_config = BotocoreConfig(
-        max_pool_connections=50,
-        retries={'max_attempts': 3, 'mode': 'adaptive'}
-    )
-    s3_client = boto3.client('s3', config=s3_config)
+    bucket = Config.SOURCE_BUCKET
     
     # List dates to check (current date and up to 5 days before)
     dates_to_check = []
@@ -194,51 +309,36 @@ def load_historical_context(uri: str, s3_mgr: S3Manager, history_mgr: HistoryMan
         check_dt = current_dt - timedelta(days=i)
         dates_to_check.append(check_dt.strftime("%Y%m%d"))
     
-    # Build index of all available files
+    # Build index of all available files, listing every date concurrently
+    # (each listing is an independent S3 round trip)
     available_files = {}  # timestamp_int -> (uri, date, minute)
-    
-    for date_str in dates_to_check:
-        prefix = f"one-minute/{date_str}/"
-        try:
-            logger.debug(f"Listing S3 files for date: {date_str}")
-            response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-            
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    key = obj['Key']
-                    file_name = key.split('/')[-1]
-                    
-                    if file_name.startswith('strikes_') and file_name.endswith('.parquet'):
-                        try:
-                            file_date, file_minute = parse_cache_key(file_name)
-                            timestamp_int = int(file_date + file_minute)
-                            file_uri = f"s3://{bucket}/{key}"
-                            available_files[timestamp_int] = (file_uri, file_date, file_minute)
-                        except:
-                            continue
-        except Exception as e:
-            logger.debug(f"Could not list files for date {date_str}: {e}")
-            continue
+    with ThreadPoolExecutor(max_workers=len(dates_to_check), thread_name_prefix='list') as lister:
+        for date_files in lister.map(lambda date_str: _list_history_files(s3_mgr, bucket, date_str),
+                                     dates_to_check):
+            available_files.update(date_files)
     
     logger.info(f"Found {len(available_files)} available files across {len(dates_to_check)} dates")
     
-    # Sort timestamps and find files before current timestamp
+    # Sort timestamps once and bisect for the files before current timestamp
     current_timestamp_int = int(current_date + current_minute)
-    sorted_timestamps = sorted([ts for ts in available_files.keys() if ts < current_timestamp_int], reverse=True)
+    sorted_timestamps = sorted(available_files)
+    current_idx = bisect.bisect_left(sorted_timestamps, current_timestamp_int)
     
-    # Load up to max_history_minutes files
-    files_to_load = sorted_timestamps[:minutes_to_load]
-    files_to_load.reverse()  # Load oldest first for chronological order
+    # Load up to max_history_minutes files, oldest first for chronological order
+    files_to_load = sorted_timestamps[max(0, current_idx - minutes_to_load):current_idx]
     
     logger.info(f"Will attempt to load {len(files_to_load)} historical files")
     
-    # Load historical files
+    # Load historical files: all reads are in flight at once, and frames are
+    # added to the history in chronological order as their reads complete
     loaded_count = 0
-    for timestamp_int in files_to_load:
-        hist_uri, hist_date, hist_minute = available_files[timestamp_int]
+    hist_files = [available_files[timestamp_int] for timestamp_int in files_to_load]
+    hist_reads = s3_mgr.read_parquet_many([hist_uri for hist_uri, _, _ in hist_files],
+                                          max_workers=Config.HISTORY_READ_WORKERS)
+    for (hist_uri, hist_date, hist_minute), hist_read in zip(hist_files, hist_reads):
         try:
             logger.debug(f"Loading historical file: {hist_uri}")
-            hist_df = s3_mgr.read_parquet(hist_uri)
+            hist_df = hist_read.result()
             
             if not hist_df.empty:
                 history_mgr.add_minute(hist_df, hist_date, hist_minute)
@@ -250,8 +350,45 @@ def load_historical_context(uri: str, s3_mgr: S3Manager, history_mgr: HistoryMan
     logger.info(f"Successfully loaded {loaded_count} historical minutes into context")
 
 
+def _list_history_files(s3_mgr: S3Manager, bucket: str, date_str: str) -> Dict[int, tuple]:
+    """
+    List the minute files of one date folder.
+    
+    Every page of the listing is read (see S3Manager.list_keys), so dates
+    with more than 1000 keys are complete. Listing errors are logged and
+    yield no files.
+    
+    Args:
+        s3_mgr: S3Manager instance
+        bucket: Source bucket
+        date_str: Date folder (YYYYMMDD)
+    
+    Returns:
+        Dictionary of timestamp_int -> (uri, date, minute)
+    """
+    files = {}
+    prefix = f"one-minute/{date_str}/"
+    try:
+        logger.debug(f"Listing S3 files for date: {date_str}")
+        for key in s3_mgr.list_keys(bucket, prefix):
+            file_name = key.split('/')[-1]
+            
+            if file_name.startswith('strikes_') and file_name.endswith('.parquet'):
+                try:
+                    file_date, file_minute = parse_cache_key(file_name)
+                    timestamp_int = int(file_date + file_minute)
+                    files[timestamp_int] = (f"s3://{bucket}/{key}", file_date, file_minute)
+                except:
+                    continue
+    except Exception as e:
+        logger.debug(f"Could not list files for date {date_str}: {e}")
+    
+    return files
+
+
 def process_file(uri: str, engine: FeatureEngine, s3_mgr: S3Manager,
-                 history_mgr: HistoryManager, mode: str, start_time: float) -> Dict[str, Any]:
+                 history_mgr: HistoryManager, mode: str, start_time: float,
+                 df_read: Optional['Future[pd.DataFrame]'] = None) -> Dict[str, Any]:
     """
     Process a single parquet file.
     
@@ -262,6 +399,8 @@ def process_file(uri: str, engine: FeatureEngine, s3_mgr: S3Manager,
         history_mgr: HistoryManager instance
         mode: Processing mode ('batch' or 'live')
         start_time: Handler start time for elapsed calculation
+        df_read: Read of uri already in flight (read-ahead), if any; read
+            errors surface here as if the file were read inline
     
     Returns:
         Batch mode: {'status': 'success', 'uri': uri}
@@ -284,9 +423,9 @@ def process_file(uri: str, engine: FeatureEngine, s3_mgr: S3Manager,
             logger.warning(f"Failed to load historical context: {e}")
             # Continue processing - features will be NaN but won't fail
     
-    # Step 1: Read parquet from S3
+    # Step 1: Read parquet from S3 (or collect the read-ahead)
     logger.info(f"Reading parquet from S3: {uri}")
-    df = s3_mgr.read_parquet(uri)
+    df = df_read.result() if df_read is not None else s3_mgr.read_parquet(uri)
     
     # Step 2: Validate DataFrame
     if df.empty:
@@ -317,10 +456,10 @@ def process_file(uri: str, engine: FeatureEngine, s3_mgr: S3Manager,
     
     # Step 6: Round numerics
     logger.info("Rounding numeric values...")
-    df_rounded = engine.round_numerics(df_with_features, decimals=Config.get_numeric_precision())
+    df_rounded = engine.round_numerics(df_with_features, decimals=Config.NUMERIC_PRECISION)
     
     # Step 7: Extract stock price (common value for the minute)
-    stock_price = float(df_rounded['stockPrice'].iloc[0])
+    stock_price = float(df_rounded['stockPrice'].iat[0])
     
     # Step 8: Mode-specific processing
     if mode == 'batch':
@@ -349,8 +488,8 @@ def process_batch_mode(uri: str, df: pd.DataFrame, date: str, minute: str,
     """
     # Step 1: Construct destination S3 URI
     dest_uri = uri.replace(
-        Config.get_source_bucket(),
-        Config.get_dest_bucket()
+        Config.SOURCE_BUCKET,
+        Config.DEST_BUCKET
     )
     
     logger.info(f"Destination URI: {dest_uri}")
@@ -363,9 +502,7 @@ def process_batch_mode(uri: str, df: pd.DataFrame, date: str, minute: str,
         source_checksum = ""
     
     # Step 3: Get feature version hash
-    from features import create_default_registry
-    registry = create_default_registry()
-    feature_version_hash = registry.compute_version_hash()
+    feature_version_hash = _get_version_hash()
     
     # Step 4: Prepare S3 tags
     tags = {
@@ -409,15 +546,24 @@ def process_live_mode(uri: str, df: pd.DataFrame, date: str, minute: str,
     """
     # Step 1: Convert DataFrame to JSON
     logger.info("Converting DataFrame to JSON for live mode response...")
-    data_json = df.to_dict(orient='records')
+    
+    # float32 feature columns are widened and re-rounded so the JSON carries
+    # the rounded decimals rather than their float32 approximations
+    float32_cols = list(df.columns[df.dtypes == np.float32])
+    if float32_cols:
+        df = df.astype({col: np.float64 for col in float32_cols})
+        df[float32_cols] = df[float32_cols].round(Config.NUMERIC_PRECISION)
+    
+    # Row records built from one native list per column: the response keeps
+    # its row form without to_dict's per-cell boxing
+    columns = df.columns.tolist()
+    data_json = [dict(zip(columns, row)) for row in zip(*(df[col].tolist() for col in columns))]
     
     # Step 2: Calculate processing time
     processing_time_ms = int((time.time() - handler_start_time) * 1000)
     
     # Step 3: Get feature version hash
-    from features import create_default_registry
-    registry = create_default_registry()
-    feature_version_hash = registry.compute_version_hash()
+    feature_version_hash = _get_version_hash()
     
     logger.info(f"Live processing complete: {processing_time_ms}ms")
     
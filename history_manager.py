@@ -5,11 +5,124 @@ This module provides temporal validation to prevent look-ahead bias by ensuring
 timestamps are strictly increasing when adding new data to the history queue.
 """
 
+import math
+import threading
 from collections import deque
-from typing import Optional, List, Tuple
+from itertools import islice
+from typing import Any, Callable, Dict, Optional, List, Tuple
+import numpy as np
 import pandas as pd
 
 
+class _RollingSums:
+    """
+    Running per-(key, column) sums over a window of keyed snapshots.
+    
+    Snapshots are (keys, values) pairs: a unique pd.Index and a matching
+    (len(keys), F) float64 array, NaN for missing values. Sums are taken of
+    values minus a per-(key, column) shift (the first value seen), so a
+    constant series has exactly zero variance and near-constant series do not
+    lose precision to cancellation.
+    """
+    
+    def __init__(self, n_columns: int):
+        """
+        Initialize empty sums.
+        
+        Args:
+            n_columns: Number of value columns (F) in each snapshot
+        """
+        self.n_columns = n_columns
+        # (timestamp_int, snapshot) of the minutes currently summed, oldest first
+        self.entries: deque = deque()
+        self.updates = 0
+        # Keys of the summed rows; the type (e.g. MultiIndex) follows the first snapshot
+        self.keys: Optional[pd.Index] = None
+        self.shift = np.empty((0, n_columns))
+        self.count = np.empty((0, n_columns))
+        self.sum = np.empty((0, n_columns))
+        self.sumsq = np.empty((0, n_columns))
+    
+    def rebuild(self, entries: List[Tuple[int, Any]]) -> None:
+        """
+        Recompute the sums from scratch, dropping keys no longer in the window.
+        
+        Args:
+            entries: (timestamp_int, snapshot) pairs, oldest first
+        """
+        snapshot_keys = [snapshot[0] for _, snapshot in entries if snapshot is not None]
+        self.keys = snapshot_keys[0].append(snapshot_keys[1:]).unique() if snapshot_keys else None
+        
+        shape = (len(self.keys) if self.keys is not None else 0, self.n_columns)
+        self.shift = np.full(shape, np.nan)
+        self.count = np.zeros(shape)
+        self.sum = np.zeros(shape)
+        self.sumsq = np.zeros(shape)
+        self.entries = deque(entries)
+        self.updates = 0
+        for _, snapshot in entries:
+            self._accumulate(snapshot, 1.0)
+    
+    def push(self, timestamp: int, snapshot: Any) -> None:
+        """Add a minute entering the window."""
+        self.entries.append((timestamp, snapshot))
+        self._accumulate(snapshot, 1.0)
+        self.updates += 1
+    
+    def pop(self) -> None:
+        """Remove the oldest minute, which has left the window."""
+        _, snapshot = self.entries.popleft()
+        self._accumulate(snapshot, -1.0)
+        self.updates += 1
+    
+    def stats(self) -> Tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Current per-(key, column) statistics.
+        
+        Returns:
+            Tuple of (keys, count, mean, var): var is the sample variance
+            (ddof=1), NaN where count < 2; mean is NaN where count is 0
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_shifted = self.sum / self.count
+            var = (self.sumsq - self.sum * mean_shifted) / (self.count - 1)
+        var = np.where(self.count > 1, np.maximum(var, 0.0), np.nan)
+        keys = self.keys if self.keys is not None else pd.Index([])
+        return keys, self.count, self.shift + mean_shifted, var
+    
+    def _accumulate(self, snapshot: Any, sign: float) -> None:
+        """Add (sign=1) or subtract (sign=-1) a snapshot's shifted values."""
+        if snapshot is None:
+            return
+        snapshot_keys, values = snapshot
+        
+        # Extend the arrays with keys first seen in this snapshot
+        if self.keys is None:
+            self.keys = snapshot_keys[:0]
+        new_keys = snapshot_keys.difference(self.keys, sort=False)
+        if len(new_keys):
+            pad = np.zeros((len(new_keys), self.n_columns))
+            self.keys = self.keys.append(new_keys)
+            self.shift = np.vstack([self.shift, np.full(pad.shape, np.nan)])
+            self.count = np.vstack([self.count, pad])
+            self.sum = np.vstack([self.sum, pad])
+            self.sumsq = np.vstack([self.sumsq, pad])
+        
+        rows = self.keys.get_indexer(snapshot_keys)
+        valid = ~np.isnan(values)
+        
+        # The first valid value of each (key, column) becomes its shift
+        shift = self.shift[rows]
+        unset = valid & np.isnan(shift)
+        shift[unset] = values[unset]
+        self.shift[rows] = shift
+        
+        deviation = np.where(valid, values - shift, 0.0)
+        self.count[rows] += sign * valid
+        self.sum[rows] += sign * deviation
+        self.sumsq[rows] += sign * deviation * deviation
+
+
 class HistoryManager:
     """
     Manages a rolling FIFO queue of minute-level DataFrames for computing lookback features.
@@ -18,6 +131,10 @@ class HistoryManager:
     are strictly greater than existing timestamps to prevent look-ahead bias.
     """
     
+    # Rolling sums are rebuilt from the window after this many incremental
+    # updates, bounding floating-point drift from repeated add/subtract
+    ROLLING_REBUILD_INTERVAL = 60
+    
     def __init__(self, window_size: int):
         """
         Initialize HistoryManager with a maximum window size.
@@ -26,7 +143,22 @@ class HistoryManager:
             window_size: Maximum number of minutes to maintain in the queue (e.g., 300)
         """
         self.window_size = window_size
-        self.queue: deque[Tuple[int, str, str, pd.DataFrame]] = deque(maxlen=window_size)
+        # Entries: (timestamp_int, date, minute, df, derived) where `derived` memoizes
+        # per-minute values computed from df (see get_derived)
+        self.queue: deque[Tuple[int, str, str, pd.DataFrame, Dict[str, Any]]] = deque(maxlen=window_size)
+        # Running window sums per (derived key, N), see rolling_stats
+        self._rolling: Dict[Tuple[str, int], _RollingSums] = {}
+        # Derived values of the minute being computed, not yet in the queue
+        # (see get_current_derived); carried into its entry by add_minute
+        self._pending: Tuple[Optional[pd.DataFrame], Dict[str, Any]] = (None, {})
+        self._pending_lock = threading.Lock()
+        # Stock price of each queued minute (NaN if unreadable) and its log
+        # (NaN unless positive) in ring buffers written at both head and
+        # head + window_size, so the last N values are always one contiguous
+        # slice (see get_window_prices)
+        self._prices = np.full(2 * window_size, np.nan)
+        self._log_prices = np.full(2 * window_size, np.nan)
+        self._price_head = 0
     
     def add_minute(self, df: pd.DataFrame, date: str, minute: str) -> None:
         """
@@ -57,8 +189,24 @@ class HistoryManager:
                     f"This would introduce look-ahead bias."
                 )
         
+        # Derived values already built for this DataFrame while it was the
+        # current minute are kept, so it is not reduced again as history
+        with self._pending_lock:
+            pending_df, derived = self._pending
+            self._pending = (None, {})
+        if pending_df is not df:
+            derived = {}
+        
         # Add to queue (automatically evicts oldest if at capacity)
-        self.queue.append((timestamp_int, date, minute, df))
+        self.queue.append((timestamp_int, date, minute, df, derived))
+        
+        # The price ring buffer evicts in step with the queue
+        price = self._minute_price(df)
+        log_price = math.log(price) if price > 0 else np.nan
+        for head in (self._price_head, self._price_head + self.window_size):
+            self._prices[head] = price
+            self._log_prices[head] = log_price
+        self._price_head = (self._price_head + 1) % self.window_size
     
     def get_history(self, lag_k: int) -> Optional[pd.DataFrame]:
         """
@@ -99,8 +247,195 @@ class HistoryManager:
         # Get last N elements (or all if N > queue size)
         window_size = min(N, len(self.queue))
         
-        # Extract DataFrames from the tuples
-        return [item[3] for item in list(self.queue)[-window_size:]]
+        # Extract DataFrames from the tuples; iterate from the right end rather
+        # than copying the whole deque
+        return [item[3] for item in islice(reversed(self.queue), window_size)][::-1]
+    
+    def get_window_prices(self, N: int) -> np.ndarray:
+        """
+        Retrieve the stock prices of the last N minutes.
+        
+        Prices are extracted once per minute in add_minute, so window
+        features read a contiguous float64 slice instead of one DataFrame
+        lookup per minute.
+        
+        Args:
+            N: Number of minutes to retrieve
+            
+        Returns:
+            Read-only view of the prices for the last N minutes, oldest first
+            (fewer if insufficient history); NaN for minutes whose stockPrice
+            could not be read
+        """
+        return self._window_view(self._prices, N)
+    
+    def get_window_log_prices(self, N: int) -> np.ndarray:
+        """
+        Retrieve the log stock prices of the last N minutes.
+        
+        Logs are taken once per minute in add_minute, so returns and
+        volatilities are differences of cached logs.
+        
+        Args:
+            N: Number of minutes to retrieve
+            
+        Returns:
+            Read-only view of the log prices for the last N minutes, oldest
+            first (fewer if insufficient history); NaN for minutes whose
+            stockPrice is unreadable or not positive
+        """
+        return self._window_view(self._log_prices, N)
+    
+    def _window_view(self, buffer: np.ndarray, N: int) -> np.ndarray:
+        """Return a read-only view of the last N values of a price ring buffer."""
+        window_size = min(max(N, 0), len(self.queue))
+        end = self._price_head + self.window_size
+        view = buffer[end - window_size:end]
+        view.flags.writeable = False
+        return view
+    
+    @staticmethod
+    def _minute_price(df: pd.DataFrame) -> float:
+        """Return the stock price of a minute (first row), or NaN if unreadable."""
+        try:
+            return float(df['stockPrice'].iat[0])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return np.nan
+    
+    def get_derived(self, lag: int, key: str, builder: Callable[[pd.DataFrame], Any]) -> Any:
+        """
+        Retrieve a value derived from the DataFrame lag minutes back, memoized per minute.
+        
+        The value is computed by builder(df) the first time a key is requested
+        for a minute and cached alongside that minute until it is evicted, so
+        lookups shared across lags, windows and files are computed once.
+        
+        Args:
+            lag: Minutes to look back, matching queue[-lag] (1 = most recent)
+            key: Cache key identifying the derived value
+            builder: Function computing the value from the minute's DataFrame
+            
+        Returns:
+            Derived value, or None if insufficient history
+        """
+        if lag < 1 or lag > len(self.queue):
+            return None
+        
+        return self._derived_entry(self.queue[-lag], key, builder)
+    
+    def get_current_derived(self, df: pd.DataFrame, key: str, builder: Callable[[pd.DataFrame], Any]) -> Any:
+        """
+        Retrieve a value derived from the minute being computed, memoized until it is added.
+        
+        Sections compute features for a minute before it is added to the
+        queue. Values derived here under the same key and builder as
+        get_derived are carried into the minute's entry when the same
+        DataFrame object is passed to add_minute, so it is not reduced again
+        once it becomes history. Safe to call from concurrent sections.
+        
+        Args:
+            df: DataFrame of the minute being computed
+            key: Cache key identifying the derived value
+            builder: Function computing the value from df
+            
+        Returns:
+            Derived value
+        """
+        with self._pending_lock:
+            pending_df, derived = self._pending
+            if pending_df is not df:
+                derived = {}
+                self._pending = (df, derived)
+        
+        if key not in derived:
+            derived[key] = builder(df)
+        return derived[key]
+    
+    def get_window_derived(self, N: int, key: str, builder: Callable[[pd.DataFrame], Any]) -> List[Any]:
+        """
+        Retrieve memoized derived values for the last N minutes (see get_derived).
+        
+        Args:
+            N: Number of minutes to retrieve
+            key: Cache key identifying the derived value
+            builder: Function computing the value from a minute's DataFrame
+            
+        Returns:
+            Derived values for the last N minutes, oldest first (fewer if
+            insufficient history)
+        """
+        if N < 1:
+            return []
+        
+        # Walk the deque once from the right end instead of indexing each lag
+        values = [self._derived_entry(entry, key, builder) for entry in islice(reversed(self.queue), N)]
+        return values[::-1]
+    
+    def rolling_stats(
+        self,
+        N: int,
+        key: str,
+        builder: Callable[[pd.DataFrame], Any],
+        n_columns: int
+    ) -> Tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Retrieve per-key rolling count, mean and sample variance over the last N minutes.
+        
+        builder(df) must return a keyed snapshot (a unique pd.Index and a
+        (len(keys), n_columns) float64 array, NaN for missing values) or None;
+        snapshots are memoized as in get_derived. Running sums are kept per
+        (key, N) and updated as minutes enter and leave the window, so each
+        call costs one snapshot add and evict rather than a pass over the
+        whole window. The sums are rebuilt every ROLLING_REBUILD_INTERVAL
+        updates, or when most of the window changed since the last call.
+        
+        Args:
+            N: Window size in minutes
+            key: Cache key identifying the derived snapshot
+            builder: Function computing the snapshot from a minute's DataFrame
+            n_columns: Number of value columns in each snapshot
+            
+        Returns:
+            Tuple of (keys, count, mean, var) over the last N minutes (fewer if
+            insufficient history): keys of every contract seen in the window
+            and (len(keys), n_columns) arrays; var is NaN where count < 2
+        """
+        window_size = min(N, len(self.queue))
+        window = list(islice(reversed(self.queue), window_size))[::-1]
+        window_stamps = [entry[0] for entry in window]
+        
+        sums = self._rolling.get((key, N))
+        if sums is None:
+            sums = self._rolling[(key, N)] = _RollingSums(n_columns)
+        
+        # Minutes leaving the window are at the front of the summed entries;
+        # minutes entering are at the end of the window
+        summed_stamps = [stamp for stamp, _ in sums.entries]
+        first = window_stamps[0] if window_stamps else None
+        n_stale = next((i for i, stamp in enumerate(summed_stamps) if stamp == first), len(summed_stamps))
+        kept = summed_stamps[n_stale:]
+        incremental = (
+            window_stamps[:len(kept)] == kept
+            and window_size - len(kept) <= max(1, window_size // 2)
+            and sums.updates < self.ROLLING_REBUILD_INTERVAL
+        )
+        
+        if incremental:
+            for _ in range(n_stale):
+                sums.pop()
+            for entry in window[len(kept):]:
+                sums.push(entry[0], self._derived_entry(entry, key, builder))
+        else:
+            sums.rebuild([(entry[0], self._derived_entry(entry, key, builder)) for entry in window])
+        
+        return sums.stats()
+    
+    def _derived_entry(self, entry: Tuple, key: str, builder: Callable[[pd.DataFrame], Any]) -> Any:
+        """Return the memoized derived value of a queue entry (see get_derived)."""
+        derived = entry[4]
+        if key not in derived:
+            derived[key] = builder(entry[3])
+        return derived[key]
     
     def get_current_size(self) -> int:
         """
@@ -116,3 +451,9 @@ class HistoryManager:
         Clear all data from the queue.
         """
         self.queue.clear()
+        self._rolling.clear()
+        self._prices.fill(np.nan)
+        self._log_prices.fill(np.nan)
+        self._price_head = 0
+        with self._pending_lock:
+            self._pending = (None, {})
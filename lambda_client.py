@@ -1,41 +1,137 @@
 """Lambda client for invoking SPY History Features Lambda."""
 
+import base64
+import gzip
 import json
 import logging
+import random
 import time
-import boto3
-from botocore.config import Config
+import uuid
 from botocore.exceptions import ClientError
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+# URI lists whose JSON exceeds this many bytes are sent gzip'd (see encode_payload)
+COMPRESS_THRESHOLD_BYTES = 1024
+
+# boto3 session shared by every LambdaClient (service models are loaded once
+# per session), and the result-polling S3 clients by (region, pool size)
+_SESSION = None
+_RESULT_S3_CLIENTS: Dict[Tuple[str, int], Any] = {}
+
+
+def _get_session():
+    """Return the module's boto3 session, creating it on first use."""
+    global _SESSION
+    if _SESSION is None:
+        # Imported lazily to keep CLI start-up fast
+        import boto3
+        _SESSION = boto3.session.Session()
+    return _SESSION
+
+
+def _next_backoff(previous_delay: float) -> float:
+    """
+    Decorrelated-jitter delay before retrying a throttled invocation.
+    
+    Args:
+        previous_delay: Previous delay in seconds (1 before the first retry)
+    
+    Returns:
+        Delay in seconds, uniform in [1, 3 * previous_delay], capped at 32
+    """
+    return min(32.0, random.uniform(1.0, previous_delay * 3))
+
+
+def encode_payload(event: Dict[str, Any]) -> bytes:
+    """
+    Serialize a batch event as compact JSON, compressing large URI lists.
+    
+    Lambda payloads must be JSON, so an s3_uris list over
+    COMPRESS_THRESHOLD_BYTES is replaced by 's3_uris_gz': base64 of the
+    gzip'd JSON list. The handler restores it before processing.
+    
+    The URI list is serialized once: its JSON (or base64) bytes are spliced
+    into the serialized envelope of the other keys rather than encoded again
+    as part of the whole event.
+    
+    Args:
+        event: Event dictionary (may contain 's3_uris')
+    
+    Returns:
+        JSON payload bytes
+    """
+    uris = event.get('s3_uris')
+    if not uris:
+        return json.dumps(event, separators=(',', ':')).encode('utf-8')
+    
+    uris_json = json.dumps(uris, separators=(',', ':')).encode('utf-8')
+    if len(uris_json) > COMPRESS_THRESHOLD_BYTES:
+        # base64 output needs no JSON escaping
+        uris_field = b'"s3_uris_gz":"' + base64.b64encode(gzip.compress(uris_json, compresslevel=1)) + b'"'
+    else:
+        uris_field = b'"s3_uris":' + uris_json
+    
+    envelope = json.dumps({k: v for k, v in event.items() if k != 's3_uris'}, separators=(',', ':')).encode('utf-8')
+    return envelope[:-1] + (b',' if len(envelope) > 2 else b'') + uris_field + b'}'
+
 
 class LambdaClient:
     """Client for invoking Lambda functions with batch events."""
     
-    def __init__(self, function_name: str, region: str = 'us-east-1'):
+    def __init__(self, function_name: str, region: str = 'us-east-1', result_prefix: Optional[str] = None,
+                 max_pool_connections: int = 50):
         """
         Initialize Lambda client.
         
         Args:
             function_name: Name of the Lambda function to invoke
             region: AWS region (default: us-east-1)
+            result_prefix: S3 URI prefix (s3://bucket/prefix/) where asynchronously
+                invoked batches write their results. Enables dispatch_batch/fetch_result.
+            max_pool_connections: Connection pool size; should be at least the
+                number of threads invoking through this client (default: 50)
         """
         self.function_name = function_name
         self.region = region
+        self.result_prefix = result_prefix
+        self.max_pool_connections = max_pool_connections
         
-        # Configure with larger connection pool and extended timeout for long-running Lambda
+        # Imported lazily to keep CLI start-up fast
+        from botocore.config import Config
+        
+        # Configure with a pool sized to the caller's fan-out (threads beyond
+        # it block on connection checkout), TCP keepalive for idle pooled
+        # connections and an extended timeout for long-running Lambda
         config = Config(
-            max_pool_connections=50,  # Increased from default 10
+            max_pool_connections=max_pool_connections,
+            tcp_keepalive=True,
             retries={'max_attempts': 3, 'mode': 'adaptive'},
             read_timeout=1200,  # 20 minutes for long-running batches
             connect_timeout=10  # 10 seconds for connection
         )
         
-        self.client = boto3.client('lambda', region_name=region, config=config)
+        # Each instance keeps its own Lambda client (and connection pool), so
+        # callers can shard invocations across instances; the session is shared
+        self.client = _get_session().client('lambda', region_name=region, config=config)
+        
+        # S3 client for polling async batch results, shared by all instances
+        # with the same region and pool size (polling is light)
+        self.s3_client = None
+        if result_prefix:
+            client_key = (region, max_pool_connections)
+            if client_key not in _RESULT_S3_CLIENTS:
+                s3_config = Config(
+                    max_pool_connections=max_pool_connections,
+                    tcp_keepalive=True,
+                    retries={'max_attempts': 3, 'mode': 'adaptive'}
+                )
+                _RESULT_S3_CLIENTS[client_key] = _get_session().client('s3', region_name=region, config=s3_config)
+            self.s3_client = _RESULT_S3_CLIENTS[client_key]
         
-        logger.info(f"LambdaClient initialized: {function_name} in {region} (max_pool_connections=50)")
+        logger.info(f"LambdaClient initialized: {function_name} in {region} "
+                    f"(max_pool_connections={max_pool_connections})")
     
     def invoke_batch(self, s3_uris: List[str], max_retries: int = 5) -> Dict[str, Any]:
         """
@@ -58,16 +154,19 @@ class LambdaClient:
         }
         
         logger.info(f"Invoking Lambda {self.function_name} with {len(s3_uris)} URIs")
-        logger.debug(f"Event payload: {json.dumps(event, indent=2)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event payload: {json.dumps(event, indent=2)}")
+        payload = encode_payload(event)
         
         # Retry loop for rate limit errors
+        wait_time = 1.0
         for attempt in range(max_retries + 1):
             try:
                 # Invoke Lambda synchronously
                 response = self.client.invoke(
                     FunctionName=self.function_name,
                     InvocationType='RequestResponse',
-                    Payload=json.dumps(event)
+                    Payload=payload
                 )
                 
                 # Parse response
@@ -76,33 +175,35 @@ class LambdaClient:
                 
                 logger.debug(f"Lambda response status: {status_code}")
                 
+                # Parse the payload once: it holds the batch result, or the
+                # error details when the function failed
+                try:
+                    result = json.loads(payload_bytes)
+                    parse_error = None
+                except json.JSONDecodeError as e:
+                    result = None
+                    parse_error = e
+                
                 # Check for Lambda execution errors
                 if 'FunctionError' in response:
                     function_error = response['FunctionError']
                     logger.error(f"Lambda function error: {function_error}")
                     
-                    # Try to parse error details from payload
-                    try:
-                        error_payload = json.loads(payload_bytes)
-                        error_message = error_payload.get('errorMessage', 'Unknown error')
-                        error_type = error_payload.get('errorType', 'Unknown')
-                        
+                    if isinstance(result, dict):
+                        error_message = result.get('errorMessage', 'Unknown error')
+                        error_type = result.get('errorType', 'Unknown')
                         raise Exception(f"Lambda function error ({error_type}): {error_message}")
-                    except json.JSONDecodeError:
-                        raise Exception(f"Lambda function error: {function_error}")
+                    raise Exception(f"Lambda function error: {function_error}")
                 
-                # Parse successful response payload
-                try:
-                    result = json.loads(payload_bytes)
-                    logger.info(f"Lambda invocation successful: "
-                              f"{result.get('success_count', 0)} succeeded, "
-                              f"{result.get('failure_count', 0)} failed")
-                    
-                    return result
-                    
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse Lambda response payload: {e}")
-                    raise Exception(f"Invalid JSON response from Lambda: {e}")
+                if parse_error is not None:
+                    logger.error(f"Failed to parse Lambda response payload: {parse_error}")
+                    raise Exception(f"Invalid JSON response from Lambda: {parse_error}")
+                
+                logger.info(f"Lambda invocation successful: "
+                          f"{result.get('success_count', 0)} succeeded, "
+                          f"{result.get('failure_count', 0)} failed")
+                
+                return result
             
             except ClientError as e:
                 error_code = e.response.get('Error', {}).get('Code', '')
@@ -110,9 +211,9 @@ class LambdaClient:
                 # Check if it's a rate limit error
                 if error_code == 'TooManyRequestsException':
                     if attempt < max_retries:
-                        # Calculate exponential backoff: 2^attempt seconds
-                        wait_time = min(2 ** attempt, 32)  # Cap at 32 seconds
-                        logger.warning(f"Rate limit exceeded, retrying in {wait_time}s (attempt {attempt + 1}/{max_retries})")
+                        # Decorrelated-jitter backoff, so throttled threads spread out
+                        wait_time = _next_backoff(wait_time)
+                        logger.warning(f"Rate limit exceeded, retrying in {wait_time:.2f}s (attempt {attempt + 1}/{max_retries})")
                         time.sleep(wait_time)
                         continue
                     else:
@@ -129,3 +230,128 @@ class LambdaClient:
         
         # Should never reach here, but just in case
         raise Exception(f"Failed to invoke Lambda after {max_retries} retries")
+    
+    def warmup(self) -> None:
+        """
+        Send a no-op warmup ping so a Lambda container is initialized before real batches.
+        
+        Failures are logged and ignored; warmup is best-effort.
+        """
+        try:
+            self.client.invoke(
+                FunctionName=self.function_name,
+                InvocationType='RequestResponse',
+                Payload=json.dumps({'warmup': True})
+            )
+        except Exception as e:
+            logger.warning(f"Lambda warmup ping failed: {e}")
+    
+    def dispatch_batch(self, s3_uris: List[str], max_retries: int = 5) -> str:
+        """
+        Invoke Lambda asynchronously (InvocationType='Event') with a batch event.
+        
+        The Lambda writes its batch result to the returned S3 URI, which can be
+        collected later with fetch_result(). Each call uses a fresh result
+        URI. The function's async retries are disabled and queued events
+        expire after 240s (template.yaml), so an invocation ends within
+        fetch_result()'s default timeout. One that times out, runs out of
+        memory or expires in the queue never publishes: fetch_result() times
+        out and the caller re-dispatches the batch.
+        
+        Args:
+            s3_uris: List of S3 URIs to process
+            max_retries: Maximum number of retries for rate limit errors (default: 5)
+        
+        Returns:
+            S3 URI where the batch result will be written
+        
+        Raises:
+            ValueError: If no result_prefix is configured
+            Exception: If Lambda invocation fails after retries
+        """
+        if not self.result_prefix:
+            raise ValueError("dispatch_batch requires a result_prefix")
+        
+        result_uri = f"{self.result_prefix.rstrip('/')}/{uuid.uuid4().hex}.json"
+        event = {
+            'mode': 'batch',
+            's3_uris': s3_uris,
+            'result_uri': result_uri
+        }
+        
+        logger.info(f"Dispatching Lambda {self.function_name} with {len(s3_uris)} URIs -> {result_uri}")
+        payload = encode_payload(event)
+        
+        wait_time = 1.0
+        for attempt in range(max_retries + 1):
+            try:
+                self.client.invoke(
+                    FunctionName=self.function_name,
+                    InvocationType='Event',
+                    Payload=payload
+                )
+                return result_uri
+            
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', '')
+                
+                if error_code == 'TooManyRequestsException' and attempt < max_retries:
+                    wait_time = _next_backoff(wait_time)
+                    logger.warning(f"Rate limit exceeded, retrying in {wait_time:.2f}s (attempt {attempt + 1}/{max_retries})")
+                    time.sleep(wait_time)
+                    continue
+                
+                logger.error(f"Lambda dispatch failed: {e}")
+                raise
+        
+        raise Exception(f"Failed to dispatch Lambda after {max_retries} retries")
+    
+    def fetch_result(self, result_uri: str, timeout: float = 1200) -> Dict[str, Any]:
+        """
+        Wait for an asynchronously invoked batch to publish its result.
+        
+        Polls the result object with exponential backoff (1s doubling to 30s),
+        then deletes it once read. A batch killed by the Lambda timeout or an
+        OOM, or dropped from the async queue, publishes nothing, so that case
+        surfaces as TimeoutError.
+        
+        Args:
+            result_uri: S3 URI returned by dispatch_batch()
+            timeout: Maximum seconds to wait (default: 1200, matching read_timeout;
+                keep >= MaximumEventAgeInSeconds + function Timeout in template.yaml)
+        
+        Returns:
+            Lambda batch result (success_count, failure_count, failures, unprocessed_files)
+        
+        Raises:
+            TimeoutError: If the result does not appear within the timeout
+            Exception: If the Lambda published an error instead of a batch result
+        """
+        bucket, key = result_uri[5:].split('/', 1)
+        deadline = time.time() + timeout
+        delay = 1.0
+        
+        while True:
+            try:
+                response = self.s3_client.get_object(Bucket=bucket, Key=key)
+                result = json.loads(response['Body'].read())
+                self.s3_client.delete_object(Bucket=bucket, Key=key)
+                
+                if 'errorMessage' in result:
+                    raise Exception(f"Lambda function error ({result.get('errorType', 'Unknown')}): "
+                                    f"{result['errorMessage']}")
+                
+                logger.info(f"Lambda batch result collected: "
+                          f"{result.get('success_count', 0)} succeeded, "
+                          f"{result.get('failure_count', 0)} failed")
+                return result
+            
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code', '') != 'NoSuchKey':
+                    raise
+            
+            if time.time() + delay > deadline:
+                raise TimeoutError(f"No result at {result_uri} after {timeout}s")
+            
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
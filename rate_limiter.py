@@ -0,0 +1,41 @@
+"""Token-bucket rate limiter for Lambda invocations."""
+
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing bursts up to `capacity` at `rate` tokens/second."""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Initialize TokenBucket.
+        
+        Args:
+            rate: Tokens added per second (sustained calls per second)
+            capacity: Maximum burst size (default: rate)
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, got {rate}")
+        
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._cond = threading.Condition()
+    
+    def acquire(self) -> None:
+        """Block until a token is available, then consume it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + self.rate * (now - self.last_refill))
+                self.last_refill = now
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                # Sleep until the next token is due (releases the lock)
+                self._cond.wait((1 - self.tokens) / self.rate)
@@ -5,29 +5,62 @@ import boto3
 from botocore.config import Config as BotocoreConfig
 from botocore.exceptions import ClientError
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import io
+import json
 import time
 import random
-from typing import Dict
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+from urllib.parse import urlencode
 
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# S3 error codes worth retrying (any 5xx status is retried as well)
+RETRYABLE_ERROR_CODES = frozenset({
+    'RequestLimitExceeded', 'SlowDown', 'ServiceUnavailable', 'ThrottlingException',
+    'TooManyRequestsException', 'InternalError', 'RequestTimeout',
+})
+
+# ETags of recently read objects kept for compute_checksum (oldest evicted first)
+ETAG_CACHE_SIZE = 256
+
+# boto3 S3 client shared by every S3Manager (clients are thread-safe); built
+# once per process, so warm Lambda invocations skip client construction
+_S3_CLIENT = None
+
+
+def _get_s3_client():
+    """Return the module's S3 client, creating it on first use."""
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        # Configure with a connection pool covering the concurrent reads and
+        # listings, and TCP keepalive for idle pooled connections
+        config = BotocoreConfig(
+            max_pool_connections=Config.S3_MAX_POOL_CONNECTIONS,
+            tcp_keepalive=True,
+            retries={'max_attempts': 3, 'mode': 'adaptive'}
+        )
+        _S3_CLIENT = boto3.client('s3', config=config)
+    return _S3_CLIENT
+
 
 class S3Manager:
     """Handles S3 read/write operations for parquet files."""
     
     def __init__(self):
-        """Initialize S3Manager with boto3 client."""
-        # Configure with larger connection pool for concurrent operations
-        config = BotocoreConfig(
-            max_pool_connections=50,  # Increased from default 10
-            retries={'max_attempts': 3, 'mode': 'adaptive'}
-        )
+        """Initialize S3Manager with the shared boto3 client."""
+        self.s3_client = _get_s3_client()
         
-        self.s3_client = boto3.client('s3', config=config)
-        logger.info("S3Manager initialized (max_pool_connections=50)")
+        # ETags from read_parquet's get_object responses, by S3 URI, so the
+        # checksum of a file just read needs no HEAD request
+        self._etags: Dict[str, str] = {}
+        self._etags_lock = threading.Lock()
+        logger.info(f"S3Manager initialized (max_pool_connections={Config.S3_MAX_POOL_CONNECTIONS})")
     
     def read_parquet(self, s3_uri: str) -> pd.DataFrame:
         """
@@ -45,16 +78,22 @@ class S3Manager:
         """
         bucket, key = self._parse_s3_uri(s3_uri)
         
-        for attempt in range(Config.get_max_retries()):
+        wait_time = Config.RETRY_BASE_DELAY
+        for attempt in range(Config.MAX_RETRIES):
             try:
                 logger.debug(f"Reading parquet from s3://{bucket}/{key} (attempt {attempt + 1})")
                 
                 # Get object from S3
                 response = self.s3_client.get_object(Bucket=bucket, Key=key)
                 
-                # Read parquet from bytes
-                parquet_bytes = response['Body'].read()
-                df = pd.read_parquet(io.BytesIO(parquet_bytes))
+                # Read parquet straight from the response bytes (no BytesIO
+                # wrapper), decoding columns on threads; arrow buffers are
+                # released as the DataFrame is built
+                parquet_buffer = pa.py_buffer(response['Body'].read())
+                self._remember_etag(s3_uri, response['ETag'])
+                table = pq.read_table(pa.BufferReader(parquet_buffer), use_threads=True, pre_buffer=True)
+                df = table.to_pandas(self_destruct=True)
+                del table
                 
                 logger.info(f"Successfully read parquet: {len(df)} rows, {len(df.columns)} columns")
                 return df
@@ -62,10 +101,10 @@ class S3Manager:
             except ClientError as e:
                 error_code = e.response.get('Error', {}).get('Code', '')
                 
-                if error_code in ['RequestLimitExceeded', 'SlowDown', 'ServiceUnavailable']:
-                    # Transient error - retry with exponential backoff
-                    if attempt < Config.get_max_retries() - 1:
-                        wait_time = self._calculate_backoff(attempt)
+                if self._is_retryable(e):
+                    # Transient error - retry with decorrelated-jitter backoff
+                    if attempt < Config.MAX_RETRIES - 1:
+                        wait_time = self._calculate_backoff(wait_time)
                         logger.warning(f"S3 throttling/error ({error_code}), retrying in {wait_time:.2f}s")
                         time.sleep(wait_time)
                         continue
@@ -78,7 +117,30 @@ class S3Manager:
                 logger.error(f"Unexpected error reading parquet: {e}")
                 raise
         
-        raise Exception(f"Failed to read parquet after {Config.get_max_retries()} attempts")
+        raise Exception(f"Failed to read parquet after {Config.MAX_RETRIES} attempts")
+    
+    def read_parquet_many(self, s3_uris: List[str], max_workers: int = 16) -> Iterator['Future[pd.DataFrame]']:
+        """
+        Read many parquet files from S3 concurrently.
+        
+        All reads are submitted at once to a thread pool sharing this
+        manager's client (and connection pool); their futures are yielded in
+        input order, so callers can consume frames in sequence while later
+        reads are still in flight.
+        
+        Args:
+            s3_uris: S3 URIs to read
+            max_workers: Maximum concurrent reads (default: 16); keep it within
+                the client's max_pool_connections
+        
+        Yields:
+            Future of each file's DataFrame (see read_parquet); read errors
+            are raised by Future.result()
+        """
+        workers = max(1, min(len(s3_uris), max_workers))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-read') as reader:
+            futures = [reader.submit(self.read_parquet, s3_uri) for s3_uri in s3_uris]
+            yield from futures
     
     def write_parquet(self, df: pd.DataFrame, s3_uri: str, tags: Dict[str, str]) -> None:
         """
@@ -95,42 +157,40 @@ class S3Manager:
         """
         bucket, key = self._parse_s3_uri(s3_uri)
         
-        for attempt in range(Config.get_max_retries()):
+        wait_time = Config.RETRY_BASE_DELAY
+        for attempt in range(Config.MAX_RETRIES):
             try:
                 logger.debug(f"Writing parquet to s3://{bucket}/{key} (attempt {attempt + 1})")
                 
-                # Convert DataFrame to parquet bytes
+                # Convert DataFrame to parquet; the buffer is uploaded as a
+                # stream rather than copied out to a bytes object
                 parquet_buffer = io.BytesIO()
                 df.to_parquet(parquet_buffer, index=False, engine='pyarrow')
-                parquet_bytes = parquet_buffer.getvalue()
+                parquet_size = parquet_buffer.tell()
+                parquet_buffer.seek(0)
                 
-                # Upload to S3
-                self.s3_client.put_object(
-                    Bucket=bucket,
-                    Key=key,
-                    Body=parquet_bytes,
-                    ContentType='application/octet-stream'
-                )
-                
-                # Apply tags
+                # Upload to S3 with the tags applied in the same request
+                # (URL-encoded x-amz-tagging header)
+                put_args = {
+                    'Bucket': bucket,
+                    'Key': key,
+                    'Body': parquet_buffer,
+                    'ContentType': 'application/octet-stream'
+                }
                 if tags:
-                    tag_set = [{'Key': k, 'Value': v} for k, v in tags.items()]
-                    self.s3_client.put_object_tagging(
-                        Bucket=bucket,
-                        Key=key,
-                        Tagging={'TagSet': tag_set}
-                    )
-                
-                logger.info(f"Successfully wrote parquet: {len(parquet_bytes)} bytes, {len(tags)} tags")
+                    put_args['Tagging'] = urlencode(tags)
+                self.s3_client.put_object(**put_args)
+                
+                logger.info(f"Successfully wrote parquet: {parquet_size} bytes, {len(tags)} tags")
                 return
                 
             except ClientError as e:
                 error_code = e.response.get('Error', {}).get('Code', '')
                 
-                if error_code in ['RequestLimitExceeded', 'SlowDown', 'ServiceUnavailable']:
-                    # Transient error - retry with exponential backoff
-                    if attempt < Config.get_max_retries() - 1:
-                        wait_time = self._calculate_backoff(attempt)
+                if self._is_retryable(e):
+                    # Transient error - retry with decorrelated-jitter backoff
+                    if attempt < Config.MAX_RETRIES - 1:
+                        wait_time = self._calculate_backoff(wait_time)
                         logger.warning(f"S3 throttling/error ({error_code}), retrying in {wait_time:.2f}s")
                         time.sleep(wait_time)
                         continue
@@ -143,12 +203,76 @@ class S3Manager:
                 logger.error(f"Unexpected error writing parquet: {e}")
                 raise
         
-        raise Exception(f"Failed to write parquet after {Config.get_max_retries()} attempts")
+        raise Exception(f"Failed to write parquet after {Config.MAX_RETRIES} attempts")
+    
+    def write_json(self, data: Dict[str, Any], s3_uri: str) -> None:
+        """
+        Write a JSON document to S3 with retry logic.
+        
+        Args:
+            data: JSON-serializable dictionary
+            s3_uri: Destination S3 URI
+        
+        Raises:
+            ValueError: If S3 URI format is invalid
+            Exception: If S3 write fails after retries
+        """
+        bucket, key = self._parse_s3_uri(s3_uri)
+        body = json.dumps(data).encode('utf-8')
+        
+        wait_time = Config.RETRY_BASE_DELAY
+        for attempt in range(Config.MAX_RETRIES):
+            try:
+                self.s3_client.put_object(
+                    Bucket=bucket,
+                    Key=key,
+                    Body=body,
+                    ContentType='application/json'
+                )
+                logger.info(f"Successfully wrote JSON: s3://{bucket}/{key} ({len(body)} bytes)")
+                return
+                
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code', '')
+                
+                if self._is_retryable(e):
+                    # Transient error - retry with decorrelated-jitter backoff
+                    if attempt < Config.MAX_RETRIES - 1:
+                        wait_time = self._calculate_backoff(wait_time)
+                        logger.warning(f"S3 throttling/error ({error_code}), retrying in {wait_time:.2f}s")
+                        time.sleep(wait_time)
+                        continue
+                
+                # Non-retryable error or max retries reached
+                logger.error(f"Failed to write JSON to S3: {e}")
+                raise
+        
+        raise Exception(f"Failed to write JSON after {Config.MAX_RETRIES} attempts")
+    
+    def list_keys(self, bucket: str, prefix: str) -> Iterator[str]:
+        """
+        Stream the keys under a prefix, across every page of the listing.
+        
+        Args:
+            bucket: S3 bucket name
+            prefix: Key prefix
+        
+        Yields:
+            Object keys in listing order
+        """
+        pages = self.s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix)
+        for key in pages.search('Contents[].Key'):
+            # Pages without 'Contents' yield None
+            if key is not None:
+                yield key
     
     def compute_checksum(self, s3_uri: str) -> str:
         """
         Compute MD5 checksum of S3 object.
         
+        Objects read by read_parquet reuse the ETag of that read; others are
+        fetched with a HEAD request.
+        
         Args:
             s3_uri: S3 URI
         
@@ -161,7 +285,14 @@ class S3Manager:
         """
         bucket, key = self._parse_s3_uri(s3_uri)
         
-        for attempt in range(Config.get_max_retries()):
+        with self._etags_lock:
+            etag = self._etags.pop(s3_uri, None)
+        if etag is not None:
+            logger.debug(f"Checksum from read: {etag}")
+            return etag
+        
+        wait_time = Config.RETRY_BASE_DELAY
+        for attempt in range(Config.MAX_RETRIES):
             try:
                 logger.debug(f"Computing checksum for s3://{bucket}/{key} (attempt {attempt + 1})")
                 
@@ -175,10 +306,10 @@ class S3Manager:
             except ClientError as e:
                 error_code = e.response.get('Error', {}).get('Code', '')
                 
-                if error_code in ['RequestLimitExceeded', 'SlowDown', 'ServiceUnavailable']:
-                    # Transient error - retry with exponential backoff
-                    if attempt < Config.get_max_retries() - 1:
-                        wait_time = self._calculate_backoff(attempt)
+                if self._is_retryable(e):
+                    # Transient error - retry with decorrelated-jitter backoff
+                    if attempt < Config.MAX_RETRIES - 1:
+                        wait_time = self._calculate_backoff(wait_time)
                         logger.warning(f"S3 throttling/error ({error_code}), retrying in {wait_time:.2f}s")
                         time.sleep(wait_time)
                         continue
@@ -191,7 +322,20 @@ class S3Manager:
                 logger.error(f"Unexpected error computing checksum: {e}")
                 raise
         
-        raise Exception(f"Failed to compute checksum after {Config.get_max_retries()} attempts")
+        raise Exception(f"Failed to compute checksum after {Config.MAX_RETRIES} attempts")
+    
+    def _remember_etag(self, s3_uri: str, etag: str) -> None:
+        """
+        Keep the ETag of a read object for compute_checksum.
+        
+        Args:
+            s3_uri: S3 URI of the object
+            etag: ETag from the object's response (quoted)
+        """
+        with self._etags_lock:
+            self._etags[s3_uri] = etag.strip('"')
+            if len(self._etags) > ETAG_CACHE_SIZE:
+                del self._etags[next(iter(self._etags))]
     
     def _parse_s3_uri(self, s3_uri: str) -> tuple:
         """
@@ -215,23 +359,36 @@ class S3Manager:
         
         return parts[0], parts[1]
     
-    def _calculate_backoff(self, attempt: int) -> float:
+    @staticmethod
+    def _is_retryable(error: ClientError) -> bool:
         """
-        Calculate exponential backoff with jitter.
+        Whether an S3 error is transient (throttling or a server-side fault).
         
         Args:
-            attempt: Retry attempt number (0-indexed)
+            error: botocore ClientError
         
         Returns:
-            Wait time in seconds
+            True if the request should be retried
         """
-        base_delay = Config.get_retry_base_delay()
-        max_delay = 60.0
+        error_code = error.response.get('Error', {}).get('Code', '')
+        status_code = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return error_code in RETRYABLE_ERROR_CODES or status_code >= 500
+    
+    def _calculate_backoff(self, previous_delay: float) -> float:
+        """
+        Calculate decorrelated-jitter backoff.
         
-        # Exponential backoff: base * 2^attempt
-        delay = min(base_delay * (2 ** attempt), max_delay)
+        Each wait is drawn from [base, 3 * previous wait], so clients throttled
+        together spread out instead of retrying in step.
         
-        # Add jitter (random 0-1 seconds)
-        jitter = random.uniform(0, 1)
+        Args:
+            previous_delay: Previous wait in seconds (the base delay before
+                the first retry)
+        
+        Returns:
+            Wait time in seconds, capped at 60
+        """
+        base_delay = Config.RETRY_BASE_DELAY
+        max_delay = 60.0
         
-        return delay + jitter
+        return min(max_delay, random.uniform(base_delay, previous_delay * 3))
@@ -1,10 +1,18 @@
 """Utility functions for SPY History Features Lambda."""
 
-import re
 from datetime import datetime, time
+from functools import lru_cache
 from typing import Tuple, Dict
 
+# Minute filename layout: strikes_YYYYMMDDHHMM.parquet
+FILENAME_PREFIX = 'strikes_'
+FILENAME_SUFFIX = '.parquet'
+FILENAME_LENGTH = len(FILENAME_PREFIX) + 12 + len(FILENAME_SUFFIX)
 
+
+# Memoized: a filename is parsed once however many helpers ask for it (a
+# few trading days of minutes fit the cache); invalid names are not cached
+@lru_cache(maxsize=65536)
 def parse_cache_key(filename: str) -> Tuple[str, str]:
     """
     Extract date and minute from filename.
@@ -28,25 +36,25 @@ def parse_cache_key(filename: str) -> Tuple[str, str]:
         ("20250325", "0935")
     """
     # Extract just the filename if full path provided
-    if '/' in filename:
-        filename = filename.split('/')[-1]
-    
-    # Validate filename format
-    pattern = r'^strikes_(\d{8})(\d{4})\.parquet$'
-    match = re.match(pattern, filename)
-    
-    if not match:
+    filename = filename.rpartition('/')[2]
+    
+    # Validate filename format: fixed layout, so the timestamp is a slice
+    stamp = filename[len(FILENAME_PREFIX):-len(FILENAME_SUFFIX)]
+    if not (len(filename) == FILENAME_LENGTH
+            and filename.startswith(FILENAME_PREFIX)
+            and filename.endswith(FILENAME_SUFFIX)
+            and stamp.isascii() and stamp.isdigit()):
         raise ValueError(
             f"Invalid filename format: '{filename}'. "
             f"Expected format: strikes_YYYYMMDDHHMM.parquet"
         )
     
-    date = match.group(1)
-    minute = match.group(2)
+    date = stamp[:8]
+    minute = stamp[8:]
     
-    # Validate date format
+    # Validate date (calendar check without strptime)
     try:
-        datetime.strptime(date, '%Y%m%d')
+        datetime(int(date[:4]), int(date[4:6]), int(date[6:]))
     except ValueError as e:
         raise ValueError(f"Invalid date in filename '{filename}': {e}")
     